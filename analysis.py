@@ -0,0 +1,373 @@
+"""
+
+  Summarises recorded sessions: distance, speed, power and heart rate zones, and time in each gear.
+  Needs NumPy, which is not required for recording.
+
+  Usage: python3 analysis.py <session directory or base directory> ...
+
+  A summary is written to each session directory, and a line for each session is printed.
+
+"""
+
+import io
+import json
+import os
+import re
+import sys
+import time
+from datetime import datetime
+
+import numpy
+
+import config
+import recording
+
+
+summaryFileName = 'summary.json'
+maxSampleGap = 5.0   # Seconds. Longer gaps between samples are counted as this long, e.g. while a sensor was disconnected.
+earthRadius = 6371000  # Mean earth radius in meters, as in main.dist
+
+emptyValuePattern = re.compile(r'(?<=,)(?:None)?(?=,|\n|$)', re.MULTILINE)
+gearLogPattern = re.compile(r'^(\d\d):(\d\d):(\d\d\.\d+)   Gear changed to (\d+)$', re.MULTILINE)
+
+# Columns to load from each CSV file
+gpsColumns = {'sessionTime': 0, 'latitude': 2, 'longitude': 3, 'speed': 6}
+heartRateColumns = {'sessionTime': 0, 'heartRate': 2}
+powerColumns = {'sessionTime': 0, 'instantaneousPower': 2, 'cadence': 5}
+# Files recorded before session times were added start with these columns instead of 'Session Time (s)'
+oldHeaderStarts = {
+	recording.gpsFileName: 'Time (UTC),',
+	recording.heartRateFileName: 'Time,',
+	recording.powerFileName: 'Time,'
+}
+oldColumns = {
+	recording.gpsFileName: {'latitude': 1, 'longitude': 2, 'speed': 5},
+	recording.heartRateFileName: {'eventTime': 0, 'heartRate': 1},
+	recording.powerFileName: {'instantaneousPower': 1, 'cadence': 4}
+}
+heartRateEventTimeRollover = 64.0  # Seconds. The ANT heart beat event time wraps around after this.
+timeZonePattern = re.compile(r'[+-]\d\d:\d\d$')
+
+
+def loadStream(sessionDir, fileName, columns, headerLines=1):
+	"""
+	Loads the columns of a recorded stream into NumPy arrays, from either its CSV or binary file.
+
+	:param sessionDir: Directory that the session was recorded to
+	:param fileName: Name of the CSV file, e.g. recording.powerFileName
+	:param columns: Dictionary of the column number in the CSV file for each field name
+	:param headerLines: Number of lines before the data starts in the CSV file
+	:return: Dictionary of a float array for each field. The arrays are empty if the file doesn't exist.
+	"""
+	binaryPath = os.path.join(sessionDir, os.path.splitext(fileName)[0] + recording.binaryFileExtension)
+	if os.path.exists(binaryPath):
+		records = recording.readBinaryFile(binaryPath)
+		return {name: numpy.asarray(records[name], dtype=float) for name in columns}
+
+	path = os.path.join(sessionDir, fileName)
+	if not os.path.exists(path):
+		return {name: numpy.zeros(0) for name in columns}
+	with open(path, encoding='utf-8') as file:
+		lines = file.read().split('\n', headerLines)
+	text = lines[headerLines] if len(lines) > headerLines else ''
+	if not text.strip():
+		return {name: numpy.zeros(0) for name in columns}
+	if not lines[0].startswith('Session Time'):
+		return loadOldStream(fileName, lines[0], text, columns)
+	data = loadColumns(text, list(columns.values()))
+	return {name: data[:, i] for i, name in enumerate(columns)}
+
+
+def loadColumns(text, columnNumbers):
+	"""
+	:param text: Rows of a CSV file, without the header
+	:return: 2D float array of the columns
+	"""
+	# Missing values are recorded as empty or None, which loadtxt can't read
+	text = emptyValuePattern.sub('nan', text)
+	return numpy.loadtxt(io.StringIO(text), delimiter=',', usecols=columnNumbers, ndmin=2)
+
+
+def loadOldStream(fileName, header, text, columns):
+	"""
+	Loads a CSV file recorded before session times were added.
+	These have no common clock, so each stream's session times are worked out on their own and don't line up:
+	GPS times are from the UTC time of the first fix, and heart rate times are from the heart beat event times.
+	Power has no times at all, so its session times are NaN.
+
+	:return: Dictionary of a float array for each field in columns
+	"""
+	if not header.startswith(oldHeaderStarts.get(fileName, 'Session Time')):
+		raise ValueError(f'{fileName} has columns that are not supported: {header}')
+	fileColumns = oldColumns[fileName]
+	data = loadColumns(text, list(fileColumns.values()))
+	stream = {name: data[:, i] for i, name in enumerate(fileColumns)}
+
+	if fileName == recording.gpsFileName:
+		times = numpy.array([timeZonePattern.sub('', line.split(',', 1)[0]).replace(' ', 'T')
+		                     for line in text.splitlines() if line], dtype='datetime64[us]')
+		stream['sessionTime'] = (times - times[0]) / numpy.timedelta64(1, 's')
+	elif fileName == recording.heartRateFileName:
+		steps = numpy.diff(stream['eventTime'], prepend=stream['eventTime'][0])
+		steps[steps < 0] += heartRateEventTimeRollover
+		stream['sessionTime'] = numpy.cumsum(steps)
+	else:
+		stream['sessionTime'] = numpy.full(len(data), numpy.nan)
+	return {name: stream[name] if name in stream else numpy.full(len(data), numpy.nan) for name in columns}
+
+
+def loadGearChanges(sessionDir, startTime):
+	"""
+	Finds the gear changes in the session's log.
+
+	:param startTime: Start time of the session, from session.json
+	:return: (session times, gears) arrays
+	"""
+	path = os.path.join(sessionDir, recording.logFileName)
+	if not os.path.exists(path):
+		return numpy.zeros(0), numpy.zeros(0, dtype=int)
+	with open(path, encoding='utf-8') as file:
+		matches = gearLogPattern.findall(file.read())
+	if not matches:
+		return numpy.zeros(0), numpy.zeros(0, dtype=int)
+
+	values = numpy.array(matches, dtype=float)
+	secondOfDay = values[:, 0] * 3600 + values[:, 1] * 60 + values[:, 2]
+	startSecondOfDay = startTime.hour * 3600 + startTime.minute * 60 + startTime.second + startTime.microsecond / 1e6
+	# The log only has the time of day, so allow for sessions that go past midnight
+	times = numpy.mod(secondOfDay - startSecondOfDay, 86400)
+	return times, values[:, 3].astype(int)
+
+
+def getSampleDurations(times, endTime):
+	"""
+	:return: How long each sample lasted, until the next sample or the end time
+	"""
+	if len(times) == 0:
+		return numpy.zeros(0)
+	return numpy.clip(numpy.diff(times, append=max(endTime, times[-1])), 0, maxSampleGap)
+
+
+def getDistances(latitudes, longitudes):
+	"""
+	Vectorised version of main.dist.
+
+	:return: Distance in meters between each pair of consecutive positions
+	"""
+	φ = numpy.radians(latitudes)
+	λ = numpy.radians(longitudes)
+	x = numpy.diff(λ) * numpy.cos((φ[1:] + φ[:-1]) / 2)
+	y = numpy.diff(φ)
+	return numpy.hypot(x, y) * earthRadius
+
+
+def getTimeInZones(values, durations, zones):
+	"""
+	:param zones: Increasing lower limits of each zone above the first
+	:return: List of seconds spent in each zone
+	"""
+	valid = ~numpy.isnan(values)
+	zoneNumbers = numpy.digitize(values[valid], zones)
+	return numpy.bincount(zoneNumbers, weights=durations[valid], minlength=len(zones) + 1).round(1).tolist()
+
+
+def getNormalisedPower(times, powers):
+	"""
+	Resamples the power to 1 s, takes the 30 s rolling average, and returns the fourth root of the mean of its fourth power.
+	Each second takes the latest power at or before it, as in sensorstats.ResampledAverage.
+	"""
+	if len(times) < 2 or numpy.isnan(times).any() or times[-1] - times[0] < 30:
+		return None
+	seconds = numpy.arange(times[0], times[-1], 1.0)
+	perSecond = powers[numpy.searchsorted(times, seconds, side='right') - 1]
+	rollingAverage = numpy.convolve(perSecond, numpy.ones(30) / 30, mode='valid')
+	return float(numpy.mean(rollingAverage ** 4) ** 0.25)
+
+
+def toNumber(value):
+	"""
+	Converts NumPy numbers to plain floats for JSON, with None for NaN.
+	"""
+	value = float(value)
+	return None if numpy.isnan(value) else round(value, 3)
+
+
+def summariseSession(sessionDir):
+	"""
+	Loads all the recorded streams of a session and summarises them.
+
+	:param sessionDir: Directory that the session was recorded to
+	:return: Dictionary of summary values
+	"""
+	startTime = None
+	try:
+		with open(os.path.join(sessionDir, recording.sessionFileName), encoding='utf-8') as file:
+			startTime = datetime.fromisoformat(json.load(file)['startTime'])
+	except (OSError, ValueError, KeyError):
+		pass
+
+	gps = loadStream(sessionDir, recording.gpsFileName, gpsColumns)
+	heartRate = loadStream(sessionDir, recording.heartRateFileName, heartRateColumns)
+	power = loadStream(sessionDir, recording.powerFileName, powerColumns)
+	gearTimes, gears = loadGearChanges(sessionDir, startTime) if startTime else (numpy.zeros(0), numpy.zeros(0, dtype=int))
+
+	allTimes = [stream['sessionTime'] for stream in (gps, heartRate, power) if len(stream['sessionTime'])]
+	endTime = float(max(numpy.nan_to_num(times[-1]) for times in allTimes)) if allTimes else 0.0
+	summary = {
+		'session': os.path.basename(os.path.normpath(sessionDir)),
+		'startTime': startTime.isoformat() if startTime else None,
+		'duration': round(endTime, 3)
+	}
+
+	hasFix = ~(numpy.isnan(gps['latitude']) | numpy.isnan(gps['longitude']))
+	speeds = gps['speed'][~numpy.isnan(gps['speed'])]
+	summary['distance'] = round(float(getDistances(gps['latitude'][hasFix], gps['longitude'][hasFix]).sum()), 1)
+	summary['averageSpeed'] = toNumber(speeds.mean()) if len(speeds) else None
+	summary['maxSpeed'] = toNumber(speeds.max()) if len(speeds) else None
+
+	powers = power['instantaneousPower']
+	hasPower = ~numpy.isnan(powers)
+	summary['averagePower'] = toNumber(powers[hasPower].mean()) if hasPower.any() else None
+	summary['maxPower'] = toNumber(powers[hasPower].max()) if hasPower.any() else None
+	normalisedPower = getNormalisedPower(power['sessionTime'][hasPower], powers[hasPower])
+	summary['normalisedPower'] = None if normalisedPower is None else round(normalisedPower, 1)
+	if numpy.isnan(power['sessionTime']).any():
+		summary['powerZones'] = None  # Recorded before power had times
+	else:
+		summary['powerZones'] = getTimeInZones(powers, getSampleDurations(power['sessionTime'], endTime),
+		                                       config.powerZones)
+
+	heartRates = heartRate['heartRate']
+	hasHeartRate = ~numpy.isnan(heartRates)
+	summary['averageHeartRate'] = toNumber(heartRates[hasHeartRate].mean()) if hasHeartRate.any() else None
+	summary['maxHeartRate'] = toNumber(heartRates[hasHeartRate].max()) if hasHeartRate.any() else None
+	summary['heartRateZones'] = getTimeInZones(heartRates, getSampleDurations(heartRate['sessionTime'], endTime),
+	                                           config.heartRateZones)
+
+	# Each gear lasts until the next change, with no gaps allowed for
+	gearDurations = numpy.diff(gearTimes, append=max(endTime, gearTimes[-1])) if len(gearTimes) else numpy.zeros(0)
+	timeInGear = numpy.bincount(gears, weights=gearDurations) if len(gears) else numpy.zeros(0)
+	summary['timeInGear'] = {str(gear): round(float(seconds), 1) for gear, seconds in enumerate(timeInGear) if seconds > 0}
+	return summary
+
+
+def findSessions(path):
+	"""
+	Finds sessions from the catalogue of their base directory, without searching the base directory.
+
+	:param path: A session directory, or a base directory containing numbered session directories
+	:return: (base directory, catalogue, sorted list of session names)
+	"""
+	path = os.path.join(path, '')
+	if os.path.exists(path + recording.sessionFileName) or os.path.exists(path + recording.logFileName):
+		baseDir, name = os.path.split(os.path.normpath(path))
+		baseDir = os.path.join(baseDir, '')
+		return baseDir, recording.readCatalogue(baseDir), [name]
+	catalogue = recording.readCatalogue(path)
+	return path, catalogue, sorted(catalogue['sessions'])
+
+
+def getSessionFileSizes(sessionDir):
+	"""
+	:return: Sizes of the recorded files, to tell if a cached summary is out of date
+	"""
+	fileSizes = recording.getFileSizes(sessionDir)
+	fileSizes.pop(summaryFileName, None)
+	return fileSizes
+
+
+def getSummary(baseDir, catalogue, name, useCache=True):
+	"""
+	Summarises a session, or gets its summary from the catalogue if none of its files have changed since.
+	The catalogue is updated with the new summary, but not written.
+
+	:return: (summary, True if it was from the catalogue)
+	"""
+	sessionDir = baseDir + name
+	session = catalogue['sessions'].setdefault(name, {})
+	fileSizes = getSessionFileSizes(sessionDir)
+	if useCache and 'summary' in session and session.get('fileSizes') == fileSizes:
+		return session['summary'], True
+	summary = summariseSession(sessionDir)
+	session['summary'] = summary
+	session['fileSizes'] = fileSizes
+	session.setdefault('startTime', summary['startTime'])
+	return summary, False
+
+
+def writeSummary(sessionDir, summary):
+	with open(os.path.join(sessionDir, summaryFileName), 'w', encoding='utf-8') as file:
+		json.dump(summary, file, indent='\t')
+
+
+def printHeading():
+	print(f'{"Session":<8}{"Minutes":>8}{"km":>9}{"Avg m/s":>9}{"Max m/s":>9}{"Avg W":>8}{"NP W":>8}{"Avg bpm":>8}')
+
+
+def printSummary(summary):
+	def show(name, width, decimals):
+		value = summary[name]
+		return f'{"-":>{width}}' if value is None else f'{value:>{width}.{decimals}f}'
+
+	print(f'{summary["session"]:<8}{summary["duration"] / 60:>8.1f}{summary["distance"] / 1000:>9.2f}'
+	      f'{show("averageSpeed", 9, 2)}{show("maxSpeed", 9, 2)}{show("averagePower", 8, 0)}'
+	      f'{show("normalisedPower", 8, 0)}{show("averageHeartRate", 8, 0)}')
+
+
+def listSessions(catalogue, since=None):
+	"""
+	Prints what the catalogue knows about each session, without opening any session files.
+
+	:param since: Only list sessions started on or after this date, as 'YYYY-MM-DD'
+	"""
+	print(f'{"Session":<8}{"Start time (UTC)":<22}{"Minutes":>8}{"MB":>8}{"km":>9}{"Avg W":>8}')
+	for name, session in sorted(catalogue['sessions'].items()):
+		startTime = session.get('startTime') or ''
+		if since and startTime[:10] < since:
+			continue
+		duration = session.get('duration')
+		summary = session.get('summary', {})
+		distance = summary.get('distance')
+		averagePower = summary.get('averagePower')
+		print(f'{name:<8}{startTime[:19].replace("T", " "):<22}'
+		      f'{"-" if duration is None else f"{duration / 60:.1f}":>8}'
+		      f'{sum(session.get("fileSizes", {}).values()) / 1e6:>8.1f}'
+		      f'{"-" if distance is None else f"{distance / 1000:.2f}":>9}'
+		      f'{"-" if averagePower is None else f"{averagePower:.0f}":>8}')
+
+
+
+if __name__ == '__main__':
+	import argparse
+	argParser = argparse.ArgumentParser(description='Summarise recorded sessions.')
+	argParser.add_argument('paths', nargs='+', help='session directories, or base directories of numbered sessions')
+	argParser.add_argument('--no-write', action='store_true', help=f"don't write {summaryFileName} or the catalogue")
+	argParser.add_argument('--force', action='store_true', help='summarise sessions again even if they are in the catalogue')
+	argParser.add_argument('--list', action='store_true', help='only list the sessions in the catalogue')
+	argParser.add_argument('--since', metavar='YYYY-MM-DD', help='only list sessions started on or after this date')
+	args = argParser.parse_args()
+
+	startTime = time.monotonic()
+	sessionCount = 0
+	cachedCount = 0
+	for path in args.paths:
+		baseDir, catalogue, names = findSessions(path)
+		if args.list:
+			listSessions(catalogue, args.since)
+			continue
+		printHeading()
+		for name in names:
+			try:
+				summary, isCached = getSummary(baseDir, catalogue, name, useCache=not args.force)
+			except Exception as error:
+				print(f'{baseDir + name}: {error}', file=sys.stderr)
+				continue
+			if not isCached and not args.no_write:
+				writeSummary(baseDir + name, summary)
+			printSummary(summary)
+			sessionCount += 1
+			cachedCount += isCached
+		if not args.no_write:
+			recording.writeCatalogue(baseDir, catalogue)
+	if not args.list:
+		print(f'Summarised {sessionCount} sessions ({cachedCount} from the catalogue) in {time.monotonic() - startTime:.2f} s')
@@ -0,0 +1,133 @@
+"""
+
+  Times the display drawing functions without a camera or screen.
+
+  Usage: python3 benchmark_display.py [--calls N] [--save results.json] [--compare baseline.json]
+
+"""
+
+import json
+import random
+import time
+
+import config
+import display
+from nullcamera import NullCamera
+
+
+def makeSpeeds(count, rng):
+	"""
+	Speeds in m/s like a ride, with the occasional loss of GPS fix.
+	"""
+	speed = 10.0
+	for i in range(count):
+		speed = min(max(speed + rng.gauss(0, 0.3), 0), 20)
+		yield (None if rng.random() < 0.02 else speed, 5000 - i * 10)
+
+
+def makePowers(count, rng):
+	power = 250.0
+	for i in range(count):
+		power = min(max(power + rng.gauss(0, 15), 0), 900)
+		yield (power, config.powerGoal)
+
+
+def makeHeartRates(count, rng):
+	heartRate = 140.0
+	for i in range(count):
+		heartRate = min(max(heartRate + rng.gauss(0, 1), 50), 200)
+		yield (heartRate,)
+
+
+def makeGears(count, rng):
+	gear = 5
+	for i in range(count // 2):
+		gear = min(max(gear + rng.choice((-1, 1)), 1), 11)
+		yield (gear, True)
+		yield (gear, False)
+
+
+def makeStatusTexts(count, rng):
+	messages = ['Connected to Heart Rate (18029)', 'Could not connect to Bicycle Power',
+	            'CPU temperature at 81.2°C', 'Gear shifter: Unexpected gear change from 3 to 4',
+	            'Could not read from gear shifter. Attempting to reconnect.\n[Errno 5] Input/output error']
+	for i in range(count):
+		yield (rng.choice(messages),)
+
+
+def showAndHideStatusText(text):
+	display.hideStatusText(display.showStatusText(text))
+
+
+benchmarks = [
+	('drawPower', display.drawPower, makePowers),
+	('drawSpeedAndDistance', display.drawSpeedAndDistance, makeSpeeds),
+	('drawHeartRate', display.drawHeartRate, makeHeartRates),
+	('drawGearNumber', display.drawGearNumber, makeGears),
+	('showStatusText', showAndHideStatusText, makeStatusTexts),
+]
+
+
+def runBenchmarks(calls=500, seed=1):
+	"""
+	Calls each display function with a realistic sequence of values and times each call.
+
+	:param calls: Number of calls to make to each function
+	:param seed: Seed for the random values, so that runs can be compared
+	:return: Dictionary of results for each function
+	"""
+	camera = NullCamera()
+	display.start(camera)
+	results = {}
+	for name, function, makeValues in benchmarks:
+		values = list(makeValues(calls, random.Random(seed)))
+		times = []
+		startBytes = camera.bytesPushed
+		for args in values:
+			startTime = time.perf_counter()
+			function(*args)
+			times.append(time.perf_counter() - startTime)
+		times.sort()
+		results[name] = {
+			'calls': len(times),
+			'mean': sum(times) / len(times),
+			'p50': times[len(times) // 2],
+			'p99': times[min(int(len(times) * 0.99), len(times) - 1)],
+			'max': times[-1],
+			'bytesPerCall': (camera.bytesPushed - startBytes) / len(times)
+		}
+	display.stop()
+	return results
+
+
+def printResults(results, baseline=None):
+	print(f'{"Function":<22}{"Mean (ms)":>11}{"p50 (ms)":>10}{"p99 (ms)":>10}{"Max (ms)":>10}{"KB/call":>10}'
+	      + (f'{"Mean vs baseline":>18}' if baseline else ''))
+	for name, result in results.items():
+		line = (f'{name:<22}{result["mean"]*1000:>11.3f}{result["p50"]*1000:>10.3f}{result["p99"]*1000:>10.3f}'
+		        f'{result["max"]*1000:>10.3f}{result["bytesPerCall"]/1024:>10.1f}')
+		if baseline and name in baseline and baseline[name]['mean'] > 0:
+			change = result['mean'] / baseline[name]['mean'] - 1
+			line += f'{change:>+17.1%}'
+		print(line)
+
+
+
+if __name__ == '__main__':
+	import argparse
+	argParser = argparse.ArgumentParser(description='Time the display drawing functions.')
+	argParser.add_argument('--calls', type=int, default=500, help='number of calls to each function')
+	argParser.add_argument('--seed', type=int, default=1, help='seed for the random values')
+	argParser.add_argument('--save', metavar='FILE', help='save results to a JSON file')
+	argParser.add_argument('--compare', metavar='FILE', help='compare with results saved in a JSON file')
+	args = argParser.parse_args()
+
+	results = runBenchmarks(args.calls, args.seed)
+	baseline = None
+	if args.compare:
+		with open(args.compare, encoding='utf-8') as file:
+			baseline = json.load(file)
+	printResults(results, baseline)
+	if args.save:
+		with open(args.save, 'w', encoding='utf-8') as file:
+			json.dump(results, file, indent='\t')
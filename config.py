@@ -6,11 +6,38 @@ videoDisplayResolution = (1920, 1080)
 heartRatePairing = (18029, 120, 1)
 powerPairing = (2920, 11, 5)
 
+# Serial port of the gear shifter.
+gearShifterPort = '/dev/serial/by-id/usb-Arduino_LLC_Arduino_Micro-if00'
+
 # Bike parameters.
 crankLength = 140.0 # mm
 
 # Power output to try to achieve.
 powerGoal = 270 # Watts
 
+# Lower limits of each power and heart rate zone above the first. Used by analysis.py.
+powerZones = (150, 200, 250, 300, 350) # Watts
+heartRateZones = (110, 130, 150, 165, 180) # bpm
+
 # Latitude and longitude of finish line. Used to calculate distance.
-finishPosition = (40.4676639, -117.06286)
\ No newline at end of file
+finishPosition = (40.4676639, -117.06286)
+
+# Start a new video file after this many seconds or megabytes, whichever comes first, so that losing power or a problem
+# with the SD card can only spoil one file. None for no limit.
+videoSegmentDuration = 300 # s
+videoSegmentSize = 500 # MB
+# Number of video files to keep. Older files are deleted as new ones are started. None to keep them all.
+videoSegmentsKept = None
+
+# Format to record sensor data in. Either 'csv', or 'binary' which is smaller and quicker to write.
+# Binary files can be read with recording.readBinaryFile.
+recordingFormat = 'csv'
+
+# Time the functions that are called most often. Timings are saved to the session directory when it is closed.
+profilingEnabled = True
+
+# CPU temperatures (°C) at which to cut back on work, to avoid the CPU slowing itself down.
+# Each temperature passed is a further level of cutting back.
+throttleTemperatures = (75, 80)
+# Average CPU load (fraction of all cores busy) at which to cut back on work.
+throttleLoad = 0.9
@@ -4,16 +4,18 @@
 
 """
 
-from threading import Timer, Lock
+from collections import OrderedDict
+from threading import Thread, Lock
 from PIL import Image, ImageDraw, ImageFont
 
 import config
+import profiling
+from scheduler import ExpiryScheduler
 
 
 class StatusOverlay:
-	def __init__(self, overlay, timer, yPos, height):
+	def __init__(self, overlay, yPos, height):
 		self.overlay = overlay
-		self.timer = timer
 		self.yPos = yPos
 		self.height = height
 
@@ -21,16 +23,21 @@ class StatusOverlay:
 camera = None
 fontPath = '/usr/share/fonts/truetype/roboto/Roboto-Regular.ttf'
 boldFontPath = '/usr/share/fonts/truetype/roboto/Roboto-Bold.ttf'
-heartImage = Image.open('./heart.png').convert('RGBA')
-titleFont = ImageFont.truetype(boldFontPath, 60)
-statusFont = ImageFont.truetype(fontPath, 35)
-infoFont = ImageFont.truetype(fontPath, 80)
-gearFont = ImageFont.truetype(fontPath, 160)
-powerFont = ImageFont.truetype(fontPath, 40)
+heartImagePath = './heart.png'
+# Fonts are (path, size) and are only loaded when first used, see loadFont.
+titleFont = (boldFontPath, 60)
+statusFont = (fontPath, 35)
+infoFont = (fontPath, 80)
+gearFont = (fontPath, 160)
+powerFont = (fontPath, 40)
+loadedFonts = {}            # Font objects, keyed by (path, size)
+loadedImages = {}           # Images, keyed by path
+assetsMutex = Lock()
 textPrimaryColour = (255, 255, 255)
 textDimColour = (128, 128, 128)
 statusBackgroundColour = (20, 20, 20, 128)
 statusColours = {
+	'debug': (160, 160, 160),
 	'info': (255, 255, 255),
 	'warning': (255, 128, 0),
 	'error': (255, 0, 0)
@@ -38,15 +45,36 @@ statusColours = {
 powerUnderColour = (207, 16, 26)
 powerIdealColour = (31, 160, 70)
 powerOverColour = (239, 122, 0)
-statusOverlayHeight = 160   # Max height of image for overlay. Must be a multiple of 16.
+# Number of pre-made status overlays of each size, smallest first. Status text uses the smallest free one that it fits
+# in, so that short messages don't push a full width image on every update. Most messages are one line, which fits 96
+# high, and several are shown at once while starting up.
+statusSlotCounts = {(512, 96): 4, (512, 128): 1, (1024, 96): 6, (1024, 128): 1}
+statusSlots = {}            # Size of each pre-made status overlay
+freeStatusSlots = {}        # Pre-made status overlays that are currently hidden, keyed by size
+statusSlotFallbacks = 0     # Number of status overlays added because no pre-made one was free that the text fits in
+statusImagePoolSize = 2     # Number of spare images to keep for each size of status overlay. 0 to disable.
+statusImagePool = {}        # Spare images, keyed by size.
+statusImagePoolMutex = Lock()
 statusPadding = 10          # Size between each status message, in pixels.
 statusOverlays = {}
 statusIdCounter = 0
+statusExpiry = ExpiryScheduler('Status expiry')   # Hides status overlays after their timeout
 overlaysMutex = Lock()
+shadowRadius = 3            # Offset of the shadow drawn around text, in pixels.
+textCacheSize = 256         # Max number of pre-rendered text images to keep.
+textCache = OrderedDict()   # Least recently used text images are at the start.
+textCacheHits = 0
+textCacheMisses = 0
+textCacheMutex = Lock()
+measureDraw = ImageDraw.Draw(Image.new('RGBA', (1, 1)))   # Only used for measuring text.
 powerBarOverlay = None
 gpsOverlay = None
 heartRateOverlay = None
 gearOverlay = None
+overlayStates = {}          # Last drawn state of each overlay, so it is only redrawn when something changes.
+overlayBytes = {}           # Last image data sent to each overlay in overlayStates.
+overlayUpdatesPushed = 0
+overlayUpdatesSkipped = 0
 
 
 
@@ -59,16 +87,32 @@ def start(piCamera):
 
 	camera = piCamera
 	camera.start_preview(fullscreen=True)
+	statusExpiry.start()
+	Thread(target=preloadAssets, name='Preload display assets', daemon=True).start()
 	powerBarOverlay = addOverlay(Image.new('RGBA', (256, 240)), (10, 10, 256, 240))
 	gpsOverlay = addOverlay(Image.new('RGBA', (512, 256)), (20, 800, 512, 256))
 	heartRateOverlay = addOverlay(Image.new('RGBA', (256, 128)), (1780, 20, 256, 128))
 	gearOverlay = addOverlay(Image.new('RGBA', (256, 256)), (1740, 860, 256, 256))
+	for overlay in (powerBarOverlay, gpsOverlay, heartRateOverlay, gearOverlay):
+		overlayStates[overlay] = None
+		overlayBytes[overlay] = bytes(overlay.window[2] * overlay.window[3] * 4)   # Initially blank
+
+	# Adding and removing overlays is slow, so make some for status text up front and re-use them.
+	for size, count in statusSlotCounts.items():
+		freeStatusSlots[size] = []
+		for i in range(count):
+			overlay = addOverlay(Image.new('RGBA', size), (0, 0) + size)
+			overlay.alpha = 0
+			statusSlots[overlay] = size
+			freeStatusSlots[size].append(overlay)
 
 
 def stop():
+	statusExpiry.stop()
 	camera.stop_preview()
 
 
+@profiling.timed
 def showStatusText(text, timeout=10, level='info'):
 	"""
 	Draws status text near the bottom of the screen.
@@ -82,7 +126,11 @@ def showStatusText(text, timeout=10, level='info'):
 	global statusOverlays
 	global statusIdCounter
 
-	image, size = makeStatusTextImage(text, statusColours[level])
+	textSize = getStatusTextSize(text)
+	with overlaysMutex:
+		slot = takeStatusSlot(textSize)
+	image, size = makeStatusTextImage(text, statusColours[level], textSize, statusSlots.get(slot))
+	x = (config.videoDisplayResolution[0] - image.width) // 2
 	y = config.videoDisplayResolution[1] - size[1] - (statusPadding * 2)
 
 	with overlaysMutex:
@@ -95,17 +143,18 @@ def showStatusText(text, timeout=10, level='info'):
 		thisId = statusIdCounter
 		statusIdCounter = statusIdCounter + 1
 		status = StatusOverlay(
-			overlay = addOverlay(image, (0, y, image.width, image.height)),
-			timer = Timer(timeout, hideStatusText, args=[thisId]),
+			overlay = showStatusOverlay(image, (x, y, image.width, image.height), slot),
 			yPos = y,
 			height = size[1]
 		)
 		statusOverlays[thisId] = status
-		status.timer.start()
+		statusExpiry.schedule(thisId, timeout, hideStatusText, thisId)
+	releaseStatusImage(image)
 
 	return thisId
 
 
+@profiling.timed
 def updateStatusText(statusId, text, timeout=10, level='info'):
 	"""
 	Updates an existing status overlay with new text.
@@ -120,14 +169,47 @@ def updateStatusText(statusId, text, timeout=10, level='info'):
 	if statusId is None:
 		return showStatusText(text, timeout, level)
 
+	textSize = getStatusTextSize(text)
+	slot = None
 	with overlaysMutex:
 		existingStatus = statusOverlays.get(statusId)
+		if existingStatus is not None:
+			imageSize = tuple(existingStatus.overlay.window[2:4])
+			# Overlay size can't be changed, so if the new text doesn't fit, find another overlay that it does fit in
+			if not isTextFitting(textSize, imageSize):
+				slot = takeStatusSlot(textSize)
+				imageSize = statusSlots.get(slot)
 	if existingStatus is not None:
-		existingStatus.timer.cancel()
-		image, size = makeStatusTextImage(text, statusColours[level])
-		updateOverlay(existingStatus.overlay, image)
-		existingStatus.timer = Timer(timeout, hideStatusText, args=[statusId])
-		existingStatus.timer.start()
+		statusExpiry.cancel(statusId)
+		image, size = makeStatusTextImage(text, statusColours[level], textSize, imageSize)
+		with overlaysMutex:
+			# The status may have expired while the text was being drawn
+			isStillShown = statusOverlays.get(statusId) is existingStatus
+			if isStillShown:
+				# Keep the bottom of the status where it is. If its height changes, move it and the overlays above it.
+				heightChange = size[1] - existingStatus.height
+				if heightChange != 0:
+					thisY = existingStatus.yPos
+					for key, each in statusOverlays.items():
+						if each.yPos <= thisY:
+							each.yPos = each.yPos - heightChange
+							w = each.overlay.window   # Tuple of x,y,w,h
+							each.overlay.window = (w[0], each.yPos, w[2], w[3])
+					existingStatus.height = size[1]
+				w = existingStatus.overlay.window   # Tuple of x,y,w,h
+				if slot is None and image.size == tuple(w[2:4]):
+					updateOverlay(existingStatus.overlay, image)
+				else:
+					x = (config.videoDisplayResolution[0] - image.width) // 2
+					newOverlay = showStatusOverlay(image, (x, existingStatus.yPos, image.width, image.height), slot)
+					releaseStatusOverlay(existingStatus.overlay)
+					existingStatus.overlay = newOverlay
+			elif slot is not None:
+				releaseStatusOverlay(slot)
+		releaseStatusImage(image)
+		if not isStillShown:
+			return showStatusText(text, timeout, level)
+		statusExpiry.schedule(statusId, timeout, hideStatusText, statusId)
 		return statusId
 
 
@@ -144,9 +226,8 @@ def hideStatusText(statusId):
 			existingStatus = statusOverlays[statusId]
 			thisY = existingStatus.yPos
 			thisHeight = existingStatus.height
-			camera.remove_overlay(existingStatus.overlay)
-			if existingStatus.timer:
-				existingStatus.timer.cancel()  # Make sure timer is stopped
+			releaseStatusOverlay(existingStatus.overlay)
+			statusExpiry.cancel(statusId)  # Make sure it is not hidden again later
 			del statusOverlays[statusId]
 
 			# Move down any overlays above this one
@@ -157,6 +238,7 @@ def hideStatusText(statusId):
 					each.overlay.window = (w[0], each.yPos, w[2], w[3])
 
 
+@profiling.timed
 def drawPower(power, goalPower):
 	"""
 	:param power: Current power in Watts.
@@ -164,20 +246,24 @@ def drawPower(power, goalPower):
 	"""
 	global powerBarOverlay
 
+	if not isOverlayStateChanged(powerBarOverlay, int(power)):
+		return
+
 	image = Image.new('RGBA', powerBarOverlay.window[2:4])
 	draw = ImageDraw.Draw(image)
 
-	textWidth1, textHeight1 = draw.textsize('Power', font=titleFont)
-	textWidth2, textHeight2 = draw.textsize('000', font=powerFont)
+	textWidth1, textHeight1 = getTextSize('Power', titleFont)
+	textWidth2, textHeight2 = getTextSize('000', powerFont)
 	textWidth = max(textWidth1, textWidth2)
 	textHeight = textHeight1 + textHeight2
 
 	draw.rectangle((0, 0, textWidth+40, textHeight+60), fill=statusBackgroundColour)
-	drawShadowedText(draw, (20, 10), 'Power', font=titleFont)
-	drawShadowedText(draw, (105, textHeight1+35), str(int(power)), font=powerFont, align='r')
+	drawShadowedText(image, (20, 10), 'Power', font=titleFont)
+	drawShadowedText(image, (105, textHeight1+35), str(int(power)), font=powerFont, align='r')
 	updateOverlay(powerBarOverlay, image)
 
 
+@profiling.timed
 def drawSpeedAndDistance(speed, distance):
 	"""
 	:param speed: Speed in meters per second.
@@ -185,38 +271,44 @@ def drawSpeedAndDistance(speed, distance):
 	"""
 	global gpsOverlay
 
-	image = Image.new('RGBA', gpsOverlay.window[2:4])
-	draw = ImageDraw.Draw(image)
-
-	drawShadowedText(draw, (0, 0), 'Speed', font=titleFont)
 	kmhText = '--' if speed is None else str(int(speed*3.6))
 	mphText = '--' if speed is None else str(int(speed*2.237))
-	drawShadowedText(draw, (2, 70), kmhText + ' km/h', font=infoFont)
-	drawShadowedText(draw, (2, 160), mphText + ' mph', font=infoFont)
+	if not isOverlayStateChanged(gpsOverlay, (kmhText, mphText)):
+		return
+
+	image = Image.new('RGBA', gpsOverlay.window[2:4])
+
+	drawShadowedText(image, (0, 0), 'Speed', font=titleFont)
+	drawShadowedText(image, (2, 70), kmhText + ' km/h', font=infoFont)
+	drawShadowedText(image, (2, 160), mphText + ' mph', font=infoFont)
 
 	# Disable drawing distance for now.
-	#drawShadowedText(draw, (200, 0), 'Dist.', font=titleFont)
+	#drawShadowedText(image, (200, 0), 'Dist.', font=titleFont)
 	#kmText = '--' if distance is None else '{0:.2f}'.format(distance/1000)
 	#miText = '--' if distance is None else '{0:.2f}'.format(distance/1609.344)
-	#drawShadowedText(draw, (202, 50), kmText + ' km', font=infoFont)
-	#drawShadowedText(draw, (202, 90), miText + ' mi.', font=infoFont)
+	#drawShadowedText(image, (202, 50), kmText + ' km', font=infoFont)
+	#drawShadowedText(image, (202, 90), miText + ' mi.', font=infoFont)
 
 	updateOverlay(gpsOverlay, image)
 
 
+@profiling.timed
 def drawHeartRate(heartRate):
 	"""
 	:param heartRate:
 	"""
 	global heartRateOverlay
 
+	if not isOverlayStateChanged(heartRateOverlay, int(heartRate)):
+		return
+
 	image = Image.new('RGBA', heartRateOverlay.window[2:4])
-	image.paste(heartImage, (0, 3, 40, 43))
-	draw = ImageDraw.Draw(image)
-	drawShadowedText(draw, (45, 2), str(int(heartRate)), font=infoFont)
+	image.paste(loadImage(heartImagePath), (0, 3, 40, 43))
+	drawShadowedText(image, (45, 2), str(int(heartRate)), font=infoFont)
 	updateOverlay(heartRateOverlay, image)
 
 
+@profiling.timed
 def drawGearNumber(gear, isChanging=False):
 	"""
 	:param gear: The number of gear the bike is currently in.
@@ -224,13 +316,16 @@ def drawGearNumber(gear, isChanging=False):
 	"""
 	global gearOverlay
 
+	if not isOverlayStateChanged(gearOverlay, (gear, isChanging)):
+		return
+
 	image = Image.new('RGBA', gearOverlay.window[2:4])
 	draw = ImageDraw.Draw(image)
 	text = str(gear)
-	textWidth, textHeight = draw.textsize(text, font=gearFont)
+	textWidth, textHeight = getTextSize(text, gearFont)
 	textColour = textDimColour if isChanging else textPrimaryColour
 	draw.rectangle((0, 0, textWidth+60, textHeight+40), fill=statusBackgroundColour)
-	drawShadowedText(draw, (30, 0), text, fill=textColour, font=gearFont)
+	drawShadowedText(image, (30, 0), text, fill=textColour, font=gearFont)
 	updateOverlay(gearOverlay, image)
 
 
@@ -250,35 +345,259 @@ def addOverlay(image, position):
 
 
 def updateOverlay(overlay, image):
-	overlay.update(image.tobytes())
+	"""
+	Sends a new image to an overlay.
+	For overlays that keep track of their state, nothing is sent if the image is the same as last time.
+	"""
+	global overlayUpdatesPushed
+	global overlayUpdatesSkipped
+
+	imageBytes = image.tobytes()
+	if overlay in overlayBytes:
+		if overlayBytes[overlay] == imageBytes:
+			overlayUpdatesSkipped = overlayUpdatesSkipped + 1
+			return
+		overlayBytes[overlay] = imageBytes
+	overlay.update(imageBytes)
+	overlayUpdatesPushed = overlayUpdatesPushed + 1
+
+
+def isOverlayStateChanged(overlay, state):
+	"""
+	Checks if what is shown on an overlay would change, and remembers the new state if so.
+
+	:param overlay: The overlay about to be drawn
+	:param state: Anything that determines what the overlay looks like, e.g. the text to draw
+	:return: True if the overlay needs to be redrawn
+	"""
+	global overlayUpdatesSkipped
+
+	if overlayStates.get(overlay) == state:
+		overlayUpdatesSkipped = overlayUpdatesSkipped + 1
+		return False
+	overlayStates[overlay] = state
+	return True
 
 
-def makeStatusTextImage(text, colour):
+def getStatusTextSize(text):
+	"""
+	:return: Size of the background of status text, including padding
+	"""
+	textWidth, textHeight = getTextSize(text, statusFont)
+	return textWidth + 60, textHeight + 40
+
+
+def isTextFitting(textSize, imageSize):
+	return imageSize is not None and textSize[0] <= imageSize[0] and textSize[1] <= imageSize[1]
+
+
+def makeStatusTextImage(text, colour, textSize, imageSize=None):
 	"""
 	Creates an image and draws the given text to it.
+
+	:param textSize: Size of the text background, from getStatusTextSize
+	:param imageSize: Size of the image, e.g. of the overlay it is for. By default the image is only as big as it
+	                  needs to be to fit the text, rounded up to a size that can be used for an overlay.
+	:return: Tuple of the image and the size of the text background within it
 	"""
-	image = Image.new('RGBA', (config.videoDisplayResolution[0], statusOverlayHeight))
+	textWidth, textHeight = textSize
+	if imageSize is None:
+		imageSize = (roundUp(textWidth, 32), roundUp(textHeight, 16))
+	image = getStatusImage(imageSize)
 	draw = ImageDraw.Draw(image)
-	textWidth, textHeight = draw.textsize(text, font=statusFont)
-	textWidth += 60  # Add some padding
-	textHeight += 40
-	x = (config.videoDisplayResolution[0] - textWidth) // 2
+	x = (image.width - textWidth) // 2
 	draw.rectangle((x, 0, x+textWidth, textHeight), fill=statusBackgroundColour)
-	drawShadowedText(draw, (x+30, 20), text, font=statusFont, fill=colour)
+	drawShadowedText(image, (x+30, 20), text, font=statusFont, fill=colour)
 	return image, (textWidth, textHeight)
 
 
-def drawShadowedText(draw, position, text, font, fill=textPrimaryColour, shadow=(0, 0, 0), align='l'):
-	x = position[0]
-	y = position[1]
-	r = 3
+def takeStatusSlot(textSize):
+	"""
+	Takes the smallest free pre-made status overlay that text fits in, so that nothing else uses it.
+	Must be called while holding overlaysMutex.
+
+	:param textSize: Size of the text background, from getStatusTextSize
+	:return: The overlay, or None if there is no free one that the text fits in
+	"""
+	for size, overlays in freeStatusSlots.items():
+		if overlays and isTextFitting(textSize, size):
+			return overlays.pop()
+	return None
+
+
+def showStatusOverlay(image, position, slot):
+	"""
+	Shows an image in a status overlay.
+	Must be called while holding overlaysMutex.
+
+	:param image: Image to draw.
+	:param position: Tuple of x,y,w,h for the overlay window.
+	:param slot: Pre-made overlay from takeStatusSlot to show the image in, or None to add a new overlay
+	:return: The overlay object
+	"""
+	global statusSlotFallbacks
+
+	if slot is None:
+		statusSlotFallbacks += 1
+		return addOverlay(image, position)
+	updateOverlay(slot, image)
+	slot.window = position
+	slot.alpha = 255
+	return slot
+
+
+def releaseStatusOverlay(overlay):
+	"""
+	Hides an overlay from showStatusOverlay, keeping it for re-use if it is one of the pre-made ones.
+	Must be called while holding overlaysMutex.
+	"""
+	if overlay in statusSlots:
+		overlay.alpha = 0
+		freeStatusSlots[statusSlots[overlay]].append(overlay)
+	else:
+		camera.remove_overlay(overlay)
+
+
+def getStatusImage(size):
+	"""
+	Gets a blank image for a status overlay, re-using a spare one of the same size if there is one.
+	"""
+	with statusImagePoolMutex:
+		spareImages = statusImagePool.get(size)
+		image = spareImages.pop() if spareImages else None
+	if image is None:
+		return Image.new('RGBA', size)
+	image.paste((0, 0, 0, 0), (0, 0) + size)
+	return image
+
+
+def releaseStatusImage(image):
+	"""
+	Gives back an image from getStatusImage once it has been sent to an overlay, so that it can be re-used.
+	"""
+	with statusImagePoolMutex:
+		spareImages = statusImagePool.setdefault(image.size, [])
+		if len(spareImages) < statusImagePoolSize:
+			spareImages.append(image)
+
+
+def drawShadowedText(image, position, text, font, fill=textPrimaryColour, shadow=(0, 0, 0), align='l'):
+	"""
+	Draws text with a shadow around it onto the given image.
+	The text is rendered once and cached, so drawing the same text again is just a composite.
+
+	:param image: RGBA image to draw on
+	:param position: x,y position of the text anchor
+	:param font: Font as (path, size)
+	:param align: 'l' or 'r' for left or right aligned
+	"""
+	textImage, offset = getShadowedTextImage(text, font, fill, shadow, align)
+	x = position[0] + offset[0]
+	y = position[1] + offset[1]
+	# Image.alpha_composite does not allow negative positions, so crop the text image instead.
+	sourceX = max(-x, 0)
+	sourceY = max(-y, 0)
+	if sourceX < textImage.width and sourceY < textImage.height:
+		image.alpha_composite(textImage, (x + sourceX, y + sourceY), (sourceX, sourceY))
+
+
+def getShadowedTextImage(text, font, fill, shadow, align):
+	"""
+	Gets an image of the given text with a shadow, from the cache if possible.
+
+	:return: Tuple of the image and the x,y offset of its top-left corner from the text anchor
+	"""
+	global textCacheHits
+	global textCacheMisses
+
+	key = (text, font, fill, shadow, align)
+	with textCacheMutex:
+		cached = textCache.get(key)
+		if cached is not None:
+			textCache.move_to_end(key)
+			textCacheHits = textCacheHits + 1
+			return cached
+		textCacheMisses = textCacheMisses + 1
+
+	cached = makeShadowedTextImage(text, font, fill, shadow, align)
+	with textCacheMutex:
+		textCache[key] = cached
+		while len(textCache) > textCacheSize:
+			textCache.popitem(last=False)
+	return cached
+
+
+def makeShadowedTextImage(text, font, fill, shadow, align):
+	"""
+	Renders text with a shadow to a new image just big enough to hold it.
+	"""
+	r = shadowRadius
+	font = loadFont(font)
 	anchor = align + 'a'  # 'a' = ascender, 'l'/'r' = left/right
+	left, top, right, bottom = measureDraw.textbbox((0, 0), text, font=font, anchor=anchor)
+	image = Image.new('RGBA', (right - left + r*2, bottom - top + r*2))
+	draw = ImageDraw.Draw(image)
+	x = r - left
+	y = r - top
 	draw.text((x, y-r), text, font=font, fill=shadow, anchor=anchor)
 	draw.text((x+r, y), text, font=font, fill=shadow, anchor=anchor)
 	draw.text((x, y+r), text, font=font, fill=shadow, anchor=anchor)
 	draw.text((x-r, y), text, font=font, fill=shadow, anchor=anchor)
-	draw.text(position, text, font=font, fill=fill, anchor=anchor)
+	draw.text((x, y), text, font=font, fill=fill, anchor=anchor)
+	return image, (left - r, top - r)
+
+
+def loadFont(font):
+	"""
+	Gets a font, loading it the first time it is used.
+
+	:param font: Tuple of the path to the font file and the size
+	:return: The font object
+	"""
+	loadedFont = loadedFonts.get(font)
+	if loadedFont is None:
+		with assetsMutex:
+			loadedFont = loadedFonts.get(font)  # In case it was loaded while waiting
+			if loadedFont is None:
+				loadedFont = loadedFonts[font] = ImageFont.truetype(*font)
+	return loadedFont
+
+
+def loadImage(path):
+	"""
+	Gets an image, loading it the first time it is used.
+	"""
+	loadedImage = loadedImages.get(path)
+	if loadedImage is None:
+		with assetsMutex:
+			loadedImage = loadedImages.get(path)
+			if loadedImage is None:
+				loadedImage = loadedImages[path] = Image.open(path).convert('RGBA')
+	return loadedImage
+
+
+def preloadAssets():
+	"""
+	Loads the fonts and images so that they are ready before they are first needed.
+	Run in the background so that it doesn't hold up starting the camera preview.
+	"""
+	for font in (titleFont, statusFont, infoFont, gearFont, powerFont):
+		loadFont(font)
+	loadImage(heartImagePath)
+
+
+def getTextSize(text, font):
+	"""
+	:param font: Font as (path, size)
+	:return: Width and height of the text when drawn at 0,0, including the space above it
+	"""
+	left, top, right, bottom = measureDraw.multiline_textbbox((0, 0), text, font=loadFont(font))
+	return right, bottom
 
 
 def clamp(value, minValue, maxValue):
 	return min(max(value, minValue), maxValue)
+
+
+def roundUp(value, multiple):
+	return -(-value // multiple) * multiple
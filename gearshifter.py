@@ -0,0 +1,219 @@
+"""
+
+  Communication with the gear shifter over serial
+
+"""
+
+import time
+from threading import Thread, Event, Lock
+from serial import Serial
+
+
+# Gear changer message codes
+STARTUP_MSG        = 'S'
+SHUTDOWN_MSG       = 'X'
+ACKNOWLEDGE_MSG    = 'A'
+ERROR_MSG          = 'E'
+DEBUG_MSG          = 'D'
+GEAR_CHANGING_MSG  = 'C'
+GEAR_CHANGED_MSG   = 'G'
+messageTypes = {STARTUP_MSG, SHUTDOWN_MSG, ACKNOWLEDGE_MSG, ERROR_MSG, DEBUG_MSG, GEAR_CHANGING_MSG, GEAR_CHANGED_MSG}
+gearMessageTypes = {GEAR_CHANGING_MSG, GEAR_CHANGED_MSG}
+
+
+class MessageParser:
+	"""
+	Splits data from the gear shifter into messages. Each message is a type character, then the value, then a new line.
+	Data can be given in pieces of any size, and incomplete messages are kept until the rest arrives.
+	"""
+	def __init__(self, maxMessageLength=256):
+		self.maxMessageLength = maxMessageLength
+		self.buffer = bytearray()
+		self.messageCount = 0      # Number of valid messages received
+		self.coalescedCount = 0    # Number of gear messages skipped because a newer one came at the same time
+		self.malformedCount = 0    # Number of messages that could not be understood
+
+	def feed(self, data):
+		"""
+		Adds data that has been read, and gets any messages that are now complete.
+		If there are several gear messages, only the latest one is returned, as the others are already out of date.
+
+		:param data: Bytes from the serial port
+		:return: List of (type, value) tuples. Value is an int for gear messages, or a string otherwise.
+		"""
+		self.buffer.extend(data)
+		end = self.buffer.rfind(b'\n')
+		if end < 0:
+			if len(self.buffer) > self.maxMessageLength:
+				self.malformedCount += 1
+				self.buffer.clear()
+			return []
+
+		messages = []
+		lastGearIndex = -1
+		start = 0
+		while start <= end:
+			lineEnd = self.buffer.find(b'\n', start)
+			message = self.parseMessage(self.buffer[start:lineEnd])
+			start = lineEnd + 1
+			if message is not None:
+				if message[0] in gearMessageTypes:
+					lastGearIndex = len(messages)
+				messages.append(message)
+		del self.buffer[:end + 1]  # Keep any incomplete message at the end
+		self.messageCount += len(messages)
+
+		if lastGearIndex >= 0:
+			count = len(messages)
+			messages = [message for i, message in enumerate(messages)
+			            if i == lastGearIndex or message[0] not in gearMessageTypes]
+			self.coalescedCount += count - len(messages)
+		return messages
+
+	def parseMessage(self, line):
+		"""
+		:return: A (type, value) tuple, or None if the message is not valid
+		"""
+		try:
+			text = line.decode('utf-8').rstrip('\r')
+			commsType, value = text[:1], text[1:]
+			if commsType not in messageTypes:
+				raise ValueError(f'Unknown message type: {text}')
+			if commsType in gearMessageTypes:
+				value = int(value)
+			return commsType, value
+		except ValueError:  # Includes UnicodeDecodeError
+			self.malformedCount += 1
+			return None
+
+
+class GearShifter:
+	"""
+	Reads from the gear shifter on a background thread, so that messages are handled as soon as they arrive.
+	Connects to it when started, and reconnects if the connection is lost.
+	"""
+	def __init__(self, port, onMessage, onError, baudRate=9600):
+		"""
+		:param port: Serial port device
+		:param onMessage: Called with the type and value of each message from the gear shifter.
+		                  Called from the background thread.
+		:param onError: Called with a message and the exception when there is a problem connecting or reading.
+		:param baudRate: Serial port speed
+		"""
+		self.port = port
+		self.onMessage = onMessage
+		self.onError = onError
+		self.baudRate = baudRate
+		self.readTimeout = 0.1       # Seconds to wait for data before checking if it should stop
+		self.minRetryDelay = 1.0     # Seconds to wait before trying to connect again
+		self.maxRetryDelay = 30.0
+		self.parser = MessageParser()
+		self.serial = None
+		self.serialLock = Lock()
+		self.thread = None
+		self.isRunning = False
+		self.dataReceived = Event()  # Set whenever data is read, so that stop() can wait for a response
+
+	def start(self):
+		self.isRunning = True
+		self.dataReceived.clear()
+		self.thread = Thread(target=self.run, name='Gear shifter', daemon=True)
+		self.thread.start()
+
+	def stop(self, responseTimeout=2.0):
+		"""
+		Tells the gear shifter to shut down, waits a little for it to respond, then stops reading.
+
+		:param responseTimeout: Max seconds to wait for a response
+		"""
+		try:
+			self.dataReceived.clear()
+			if self.write(SHUTDOWN_MSG):
+				self.dataReceived.wait(responseTimeout)
+		finally:
+			self.isRunning = False
+			if self.thread is not None:
+				self.thread.join()
+				self.thread = None
+			self.disconnect()
+
+	def isConnected(self):
+		return self.serial is not None
+
+	def waitForResponse(self, timeout):
+		"""
+		Waits for the gear shifter to send a message, e.g. the gear it is in after it has been told the Pi has started.
+
+		:param timeout: Max seconds to wait
+		:return: True if a message has been received
+		"""
+		return self.dataReceived.wait(timeout)
+
+	def write(self, message):
+		"""
+		:return: True if the message was sent, or False if not connected
+		"""
+		with self.serialLock:
+			if self.serial is None:
+				return False
+			self.serial.write(message.encode('utf-8'))
+			return True
+
+	def run(self):
+		retryDelay = self.minRetryDelay
+		while self.isRunning:
+			if self.serial is None:
+				if self.connect():
+					retryDelay = self.minRetryDelay
+				else:
+					self.sleep(retryDelay)
+					retryDelay = min(retryDelay * 2, self.maxRetryDelay)
+					continue
+
+			try:
+				# Wait for at least one byte, then take whatever else has arrived
+				data = self.serial.read(max(1, self.serial.in_waiting))
+			except Exception as error:
+				self.onError('Could not read from gear shifter. Attempting to reconnect.', error)
+				self.disconnect()
+				continue
+
+			for commsType, value in self.parser.feed(data):
+				self.dataReceived.set()
+				try:
+					self.onMessage(commsType, value)
+				except Exception as error:
+					self.onError('Could not handle message from gear shifter.', error)
+
+	### Private methods ###
+
+	def connect(self):
+		"""
+		:return: True if connected successfully
+		"""
+		try:
+			with self.serialLock:
+				self.serial = Serial(self.port, self.baudRate, timeout=self.readTimeout)
+			self.parser.buffer.clear()  # Throw away anything left over from the last connection
+			return self.write(STARTUP_MSG)
+		except Exception as error:
+			self.disconnect()
+			self.onError('Could not connect to gear shifter.', error)
+			return False
+
+	def disconnect(self):
+		with self.serialLock:
+			if self.serial is not None:
+				try:
+					self.serial.close()
+				except Exception:
+					pass
+				self.serial = None
+
+	def sleep(self, seconds):
+		"""
+		Sleeps, but returns early if stopped.
+		"""
+		endTime = time.monotonic() + seconds
+		while self.isRunning and time.monotonic() < endTime:
+			time.sleep(min(self.readTimeout, endTime - time.monotonic()))
@@ -0,0 +1,59 @@
+"""
+
+  Decides how much to cut back on work when the CPU is getting too hot or too busy
+
+"""
+
+from collections import deque
+
+
+class ThermalGovernor:
+	"""
+	Keeps a rolling window of CPU temperature and load samples, and works out a throttle level from their averages.
+	Level 0 is normal. Each temperature threshold that is passed adds a level.
+	The level only goes back down once the temperature is a few degrees below the threshold, so it doesn't flip back
+	and forth around it.
+	"""
+	def __init__(self, temperatures, maxLoad, windowSize=5, hysteresis=3.0):
+		"""
+		:param temperatures: Increasing list of temperatures (°C), one for each throttle level above 0
+		:param maxLoad: Fraction of CPU load above which to be at least level 1
+		:param windowSize: Number of samples to average over
+		:param hysteresis: Degrees below a threshold that the temperature must go to drop back a level
+		"""
+		self.temperatures = temperatures
+		self.maxLoad = maxLoad
+		self.hysteresis = hysteresis
+		self.temperatureSamples = deque(maxlen=windowSize)
+		self.loadSamples = deque(maxlen=windowSize)
+		self.level = 0
+		self.maxLevel = len(temperatures)
+
+	def addSample(self, temperature, load):
+		"""
+		:param temperature: CPU temperature in °C
+		:param load: CPU load as a fraction of all cores being busy
+		:return: True if the throttle level has changed
+		"""
+		self.temperatureSamples.append(temperature)
+		self.loadSamples.append(load)
+		averageTemperature = self.getAverageTemperature()
+
+		level = 0
+		for i, threshold in enumerate(self.temperatures):
+			# Use the lower threshold for levels we are already at or above
+			if averageTemperature >= (threshold - self.hysteresis if self.level > i else threshold):
+				level = i + 1
+		if self.getAverageLoad() >= self.maxLoad:
+			level = max(level, 1)
+
+		if level != self.level:
+			self.level = level
+			return True
+		return False
+
+	def getAverageTemperature(self):
+		return sum(self.temperatureSamples) / len(self.temperatureSamples) if self.temperatureSamples else 0
+
+	def getAverageLoad(self):
+		return sum(self.loadSamples) / len(self.loadSamples) if self.loadSamples else 0
@@ -4,10 +4,15 @@
 
 """
 
-import os
 import time
+programStartTime = time.monotonic()  # Taken before the other imports so that they are included in the startup times
+
+import os
 import math
-from serial import Serial
+import signal
+import traceback
+from concurrent.futures import ThreadPoolExecutor, wait
+from threading import Event, Lock, Thread
 
 import RPi.GPIO as GPIO
 from ant.core import driver
@@ -21,35 +26,87 @@ import gpsd
 
 import config
 import display
+import profiling
 import recording
+from gearshifter import GearShifter, ACKNOWLEDGE_MSG, ERROR_MSG, DEBUG_MSG, GEAR_CHANGING_MSG, GEAR_CHANGED_MSG
+from governor import ThermalGovernor
+from scheduler import PeriodicScheduler
+from sensorstats import SensorStats
 
 
-# Gear changer message codes
-STARTUP_MSG        = 'S'
-SHUTDOWN_MSG       = 'X'
-ACKNOWLEDGE_MSG    = 'A'
-ERROR_MSG          = 'E'
-DEBUG_MSG          = 'D'
-GEAR_CHANGING_MSG  = 'C'
-GEAR_CHANGED_MSG   = 'G'
-
 original_send_buffer = None
+startupTimes = []          # (name, seconds) for each step of starting up
+startupFutures = []        # Devices being started in the background
+startupRemaining = 0       # Number of devices that haven't finished starting
+startupMutex = Lock()
+camera = None
+antNode = None
 tempMessageId = None
+throttleMessageId = None
 gpsMessageId = None
 gearMessageId = None
-gearComms = None
+gearShifter = None
+gearShifterStartupTimeout = 5.0  # Seconds to wait for the gear shifter to respond before reporting it as not started
 heartRateMonitor = None
 powerMonitor = None
 power = 0
 heartRate = 0
+powerStats = SensorStats('Power')
+heartRateStats = SensorStats('Heart rate', maxRate=4)
 cpuWarnTemperature = 80  # Degrees C
 cpuBadTemperature = 90
+governor = ThermalGovernor(config.throttleTemperatures, config.throttleLoad)
+# Tasks to run less often when the CPU needs a rest. Only the GPS overlay is drawn by a task for now. Add 'Power' and
+# 'Heart rate' if their tasks are enabled again in makeTasks.
+throttledTaskNames = {'GPS update'}
+normalFlushInterval = recording.flushInterval
+mainTasks = None
+videoSplitThread = None
+isTimingReportRequested = False  # Set by SIGUSR1
+shutdownPin = 3            # Physical/Board pin 5, GPIO/BCM pin 3
+isGpsConnected = False
+isGpsActive = False
+shutdownHeld = False       # Track if shut-down button is held down
+shouldShutdown = False     # If terminating should also shut down the operating system
+hasAbortedBefore = False   # Track if shut down was aborted once already
 
 
 #-------------------------------------------------#
 #  ANT Callbacks                                  #
 #-------------------------------------------------#
 
+class NewEventFilter:
+	"""
+	ANT sensors repeat the same message several times between events, e.g. between crank rotations or heart beats.
+	This lets through only the messages for a new event, going by the event count or event time in the message.
+	"""
+	def __init__(self, name):
+		self.name = name
+		self.lastEvent = None
+		self.rawCount = 0     # Number of messages received
+		self.uniqueCount = 0  # Number of messages for a new event
+
+	def isNew(self, event):
+		self.rawCount += 1
+		if event == self.lastEvent:
+			return False
+		self.lastEvent = event
+		self.uniqueCount += 1
+		return True
+
+	def reset(self):
+		self.lastEvent = None
+
+	def __str__(self):
+		return f'{self.name}: {self.uniqueCount} new events from {self.rawCount} messages'
+
+
+heartRateEvents = NewEventFilter('Heart rate')
+powerEvents = NewEventFilter('Power')
+torqueEvents = NewEventFilter('Torque and pedal')
+profileEventFilters = {}    # Event filters for the data from each ANT device profile, keyed by profile
+
+
 def devicePaired(deviceProfile, channelId):
 	showMessage(f'Connected to {deviceProfile.name} ({channelId.deviceNumber})')
 
@@ -65,23 +122,37 @@ def searchTimedOut(deviceProfile):
 
 def channelClosed(deviceProfile):
 	recording.log(f'Channel closed for {deviceProfile.name}')
+	# The event count starts again when the sensor reconnects, so don't ignore its first event
+	for eventFilter in profileEventFilters.get(deviceProfile, ()):
+		eventFilter.reset()
 
 
+@profiling.timed
 def heartRateData(hr, eventTime, interval):
 	global heartRate
+	if not heartRateEvents.isNew(eventTime):
+		return
 	heartRate = hr
+	heartRateStats.add(recording.getSessionTime(), hr)
 	recording.writeHeartRateEvent(eventTime, heartRate)
 
 
+@profiling.timed
 def powerData(eventCount, pedalPowerRatio, cadence, accumulatedPower, instantaneousPower):
 	global power
+	if not powerEvents.isNew(eventCount):
+		return
 	power = instantaneousPower
+	powerStats.add(recording.getSessionTime(), instantaneousPower)
 	ratio = '' if pedalPowerRatio is None else pedalPowerRatio
-	recording.writePowerEvent(0, instantaneousPower, accumulatedPower, ratio, cadence)
+	recording.writePowerEvent(eventCount, instantaneousPower, accumulatedPower, ratio, cadence)
 
 
+@profiling.timed
 def torqueAndPedalData(eventCount, leftTorque, rightTorque, leftPedalSmoothness, rightPedalSmoothness):
-	recording.writeTorqueEvent(0, leftTorque, rightTorque, leftPedalSmoothness, rightPedalSmoothness)
+	if not torqueEvents.isNew(eventCount):
+		return
+	recording.writeTorqueEvent(eventCount, leftTorque, rightTorque, leftPedalSmoothness, rightPedalSmoothness)
 
 
 
@@ -95,9 +166,20 @@ def showMessage(string, err=None):
 	display.showStatusText(msg, level=('error' if err is not None else 'info'))
 
 
+def showThrottleMessage(level):
+	global throttleMessageId
+	if level > 0:
+		string = (f'CPU at {governor.getAverageTemperature():.0f}°C and {governor.getAverageLoad():.0%} load. '
+		          f'Reducing work to level {level}.')
+	else:
+		string = 'CPU has cooled down. Back to normal work.'
+	recording.log(string)
+	throttleMessageId = display.updateStatusText(throttleMessageId, string, level=('warning' if level > 0 else 'info'))
+
+
 def showHighTemperatureMessage(value):
 	global tempMessageId
-	statusLevel = 'error' if temperature > cpuBadTemperature else 'warning'
+	statusLevel = 'error' if value > cpuBadTemperature else 'warning'
 	string = f'CPU temperature at {value}°C'
 	recording.log(string)
 	tempMessageId = display.updateStatusText(tempMessageId, string, level=statusLevel)
@@ -113,7 +195,7 @@ def showGearMessage(string, err=None, level='info'):
 	global gearMessageId
 	recording.log((string + '    ' + str(err)) if err else string)
 	msg = (string + '\n' + str(err)) if err else string
-	gearMessageId = display.updateStatusText(gearMessageId, msg, level)
+	gearMessageId = display.updateStatusText(gearMessageId, msg, level=level)
 
 
 
@@ -121,71 +203,59 @@ def showGearMessage(string, err=None, level='info'):
 #  Gear shifter functions                         #
 #-------------------------------------------------#
 
-def readFromGearShifter():
+@profiling.timed
+def handleGearShifterMessage(commsType, value):
 	"""
-	Attempts to read from the gear shifter, connecting to it if not already connected.
+	Handle a message from the gear shifter. Called from the gear shifter's thread.
+	Update the gear number if necessary, and display any errors.
 
-	:return: data or None if there is no data available
+	:param commsType: Message type, one of the message codes in gearshifter
+	:param value: Gear number for gear messages, otherwise the message text
 	"""
-	global gearComms
-
-	if gearComms is None:
-		try:
-			# A timeout of 0 means non-blocking mode, read() returns immediately with whatever is in the buffer.
-			gearComms = Serial('/dev/serial/by-id/usb-Arduino_LLC_Arduino_Micro-if00', 9600, timeout=0)
-			gearComms.write(STARTUP_MSG.encode('utf-8'))
-		except Exception as error1:
-			showMessage('Could not connect to gear shifter.', error1)
-			return None
+	if commsType == GEAR_CHANGING_MSG:
+		display.drawGearNumber(value, isChanging=True)
+	elif commsType == GEAR_CHANGED_MSG:
+		display.drawGearNumber(value)
+		recording.log(f'Gear changed to {value}')  # For time in each gear, in analysis.py
+	elif commsType == ACKNOWLEDGE_MSG:
+		recording.log(f'Gear shifter acknowledged message. Response: {value}')
+	else:
+		level = 'info'
+		if commsType == ERROR_MSG:
+			level = 'error'
+		elif commsType == DEBUG_MSG:
+			level = 'debug'
+		showGearMessage(f'Gear shifter: {value}', level=level)
 
-	try:
-		numBytes = gearComms.in_waiting  # This throws if not connected
-		if numBytes > 1:
-			return gearComms.read(numBytes)
-	except Exception as error2:
-		showMessage('Could not read from gear shifter. Attempting to reconnect.', error2)
-		try:
-			gearComms.close()
-			gearComms.open()
-			gearComms.write(STARTUP_MSG.encode('utf-8'))
-		except Exception as error3:
-			showMessage('Could not connect to gear shifter.', error3)
 
-	return None
 
+#-------------------------------------------------#
+#  Miscellaneous functions                        #
+#-------------------------------------------------#
 
-def handleGearShifterComms(data):
+def requestTimingReport(signalNumber, frame):
 	"""
-	Read serial communication from gear shifter.
-	Update the gear number if necessary, and display any errors.
+	Signal handler for `kill -USR1 <pid>`. The report is saved by the main loop, because the signal can arrive while
+	the main thread holds a lock that saving the report needs.
+	"""
+	global isTimingReportRequested
+	isTimingReportRequested = True
 
-	:param data: Bytes from the serial port
-	"""
-	# Perhaps make the gear number go grey when gear is changing.
-	# Send 'C<num>' from Arduino, where <num> is the new gear.
-	# drawGearNumber could accept an isChanging parameter.
-	buffer = data.decode('utf-8')
-	for line in filter(None, buffer.split('\n')):
-		commsType, value = line[:1], line[1:]
-		if commsType == GEAR_CHANGING_MSG:
-			display.drawGearNumber(int(value), isChanging=True)
-		elif commsType == GEAR_CHANGED_MSG:
-			display.drawGearNumber(int(value))
-		elif commsType == ACKNOWLEDGE_MSG:
-			recording.log(f'Gear shifter acknowledged message. Response: {value}')
-		else:
-			level = 'info'
-			if commsType == ERROR_MSG:
-				level = 'error'
-			elif commsType == DEBUG_MSG:
-				level = 'debug'
-			showGearMessage(f'Gear shifter: {value}', level=level)
 
+def checkTimingReport():
+	global isTimingReportRequested
+	if isTimingReportRequested:
+		isTimingReportRequested = False
+		writeTimingReport()
 
 
-#-------------------------------------------------#
-#  Miscellaneous functions                        #
-#-------------------------------------------------#
+def writeTimingReport():
+	"""
+	Saves timings so far to the session directory.
+	"""
+	profiling.writeReport(recording.currentDir + recording.timingFileName)
+	recording.log('Saved timing report.')
+
 
 def getCPUTemperature():
 	with open("/sys/class/thermal/thermal_zone0/temp", "r") as f:
@@ -215,19 +285,16 @@ def dist(a, b):
 #  Shutdown functions                             #
 #-------------------------------------------------#
 def shutDownGearShifter():
-	if gearComms is not None:
-		showMessage('Telling gear shifter to shutdown.')
+	if gearShifter is not None:
+		if gearShifter.isConnected():
+			showMessage('Telling gear shifter to shutdown.')
 		try:
-			gearComms.write(SHUTDOWN_MSG.encode('utf-8'))
-			waitCount = 0
-			while waitCount < 10 and gearComms.in_waiting < 2: # Wait for response, if any
-				time.sleep(0.2)
-				waitCount += 1
-			gearData = readFromGearShifter()
-			if gearData is not None:
-				handleGearShifterComms(gearData)
+			gearShifter.stop()
 		except Exception as error:
 			raise Exception('Could not stop gear shifter.    ' + str(error))
+		parser = gearShifter.parser
+		recording.log(f'Gear shifter messages: {parser.messageCount} received, '
+		              f'{parser.coalescedCount} skipped as out of date, {parser.malformedCount} malformed')
 
 
 def stopRecordingVideo():
@@ -246,8 +313,9 @@ def stopSensors():
 		if powerMonitor is not None:
 			showMessage('Stopping power monitor.')
 			powerMonitor.close()
-		showMessage('Stopping ANT.')
-		antNode.stop()
+		if antNode is not None:
+			showMessage('Stopping ANT.')
+			antNode.stop()
 	except ANTException as error:
 		showMessage('Could not stop ANT.', error)
 
@@ -256,8 +324,29 @@ class DummyCamera:
 	"""
 	Dummy camera class for when real camera is not available but still want to run the program.
 	"""
-	def __init__(self):
+	framerate = 49
+	keyFrameInterval = 60  # Frames
+	fakeFrameSize = 64     # Bytes of fake video data for each frame
+
+	def __init__(self, writesFakeFrames=False):
+		"""
+		:param writesFakeFrames: Whether recording writes fake video frames, for testing the frame index.
+		                         Otherwise recording does nothing, so as not to fill the SD card or use the CPU.
+		"""
+		self.writesFakeFrames = writesFakeFrames
 		self.overlays = []
+		self.frame = None
+		self.recordingThread = None
+		self.isRecording = False
+		self.splitOutput = None
+		self.splitDone = Event()
+
+	@property
+	def timestamp(self):
+		"""
+		Microseconds on the camera's clock, like PiCamera.timestamp
+		"""
+		return time.monotonic_ns() // 1000
 
 	def start_preview(self, **options):
 		pass
@@ -274,14 +363,70 @@ class DummyCamera:
 		self.overlays.remove(overlay)
 
 	def start_recording(self, output, format=None, resize=None, splitter_port=1, **options):
-		pass
+		"""
+		If writing fake frames and the output is a file-like object, writes a fake frame to it at the frame rate,
+		setting self.frame like PiCamera does, so that frame indexing can be tested.
+		"""
+		if not self.writesFakeFrames or not hasattr(output, 'write'):
+			return
+		self.isRecording = True
+		self.recordingThread = Thread(target=self.writeFakeFrames, args=(output,), name='Dummy camera', daemon=True)
+		self.recordingThread.start()
+
+	def split_recording(self, output, splitter_port=1, **options):
+		"""
+		Switches to writing to another output at the next key frame, like PiCamera does.
+		"""
+		if not self.isRecording:
+			return
+		self.splitDone.clear()
+		self.splitOutput = output
+		self.splitDone.wait()
 
 	def stop_recording(self):
-		pass
+		self.isRecording = False
+		if self.recordingThread is not None:
+			self.recordingThread.join()
+			self.recordingThread = None
+		self.frame = None
+
+	def writeFakeFrames(self, output):
+		index = 0
+		nextFrameTime = time.monotonic()
+		while self.isRecording:
+			isKeyFrame = index % self.keyFrameInterval == 0
+			if isKeyFrame:
+				if self.splitOutput is not None:
+					output.flush()
+					output = self.splitOutput
+					self.splitOutput = None
+					self.splitDone.set()
+				self.frame = FakeVideoFrame(index, None, False, True)
+				output.write(b'\0' * 16)
+			self.frame = FakeVideoFrame(index, self.timestamp, isKeyFrame, False)
+			output.write(b'\0' * self.fakeFrameSize)
+			index += 1
+			nextFrameTime += 1 / self.framerate
+			time.sleep(max(nextFrameTime - time.monotonic(), 0))
+		output.flush()
+
+
+class FakeVideoFrame:
+	"""
+	The parts of picamera.PiVideoFrame that are used for indexing frames.
+	"""
+	def __init__(self, index, timestamp, keyframe, header):
+		self.index = index
+		self.timestamp = timestamp
+		self.keyframe = keyframe
+		self.header = header
+		self.complete = True
+
 
 class MockOverlay:
 	def __init__(self, window):
 		self.window = window
+		self.alpha = 255
 
 	def update(self, imageBytes):
 		pass
@@ -318,29 +463,37 @@ def patchPiCamera():
 #  Initialization                                 #
 #-------------------------------------------------#
 
-recording.openFiles()
+def startCamera():
+	global camera
 
-camera = None
-try:
-	patchPiCamera()
-
-	## For more information about camera modes, see
-	## https://picamera.readthedocs.io/en/latest/fov.html#sensor-modes
-	## Note that the mini ("spy") camera only comes in a V1 module.
-	camera = picamera.PiCamera(sensor_mode=5)
-	camera.exposure_mode = 'sports'  # To reduce motion blur.
-	camera.framerate = 49  # Highest supported by mode 5
-
-	display.start(camera)
-except picamera.exc.PiCameraError as cameraError:
-	camera = DummyCamera()
-	display.start(camera)
-	showMessage('Could not start camera', cameraError)
-
-
-showMessage('Starting up ANT...')
-antNode = Node(driver.USB2Driver())
-try:
+	try:
+		patchPiCamera()
+
+		## For more information about camera modes, see
+		## https://picamera.readthedocs.io/en/latest/fov.html#sensor-modes
+		## Note that the mini ("spy") camera only comes in a V1 module.
+		camera = picamera.PiCamera(sensor_mode=5)
+		camera.exposure_mode = 'sports'  # To reduce motion blur.
+		camera.framerate = 49  # Highest supported by mode 5
+		# Frame timestamps on the camera's clock, like camera.timestamp, rather than from the start of each recording.
+		# recording.IndexedVideoOutput relies on this to work out the session time of each frame.
+		camera.clock_mode = 'raw'
+
+		display.start(camera)
+	except picamera.exc.PiCameraError as cameraError:
+		camera = DummyCamera()
+		display.start(camera)
+		showMessage('Could not start camera', cameraError)
+
+
+def startAnt():
+	global antNode
+	global heartRateMonitor
+	global powerMonitor
+
+	showMessage('Starting up ANT...')
+	antNode = Node(driver.USB2Driver())
+	# Any error is shown by reportStartupStep
 	antNode.start()
 	network = Network(key=NETWORK_KEY_ANT_PLUS, name='N:ANT+')
 	antNode.setNetworkKey(NETWORK_NUMBER_PUBLIC, network)
@@ -356,126 +509,306 @@ try:
 	                      'onChannelClosed': channelClosed,
 	                      'onPowerData': powerData,
 	                      'onTorqueAndPedalData': torqueAndPedalData})
+	profileEventFilters[heartRateMonitor] = (heartRateEvents,)
+	profileEventFilters[powerMonitor] = (powerEvents, torqueEvents)
 
 	heartRateMonitor.open(ChannelID(*config.heartRatePairing), searchTimeout=300)
 	powerMonitor.open(ChannelID(*config.powerPairing), searchTimeout=300)
 	showMessage('ANT started. Connecting to devices...')
-except ANTException as antError:
-	showMessage('Could not start ANT.', antError)
 
-showMessage('Connecting to GPS service...')
-gpsd.connect()
-time.sleep(1)
 
-display.drawSpeedAndDistance(None, None)
-recording.startRecordingVideo(camera)
+def startGearShifter():
+	global gearShifter
+
+	gearShifter = GearShifter(config.gearShifterPort, handleGearShifterMessage, showMessage)
+	gearShifter.start()
+	# Starting only starts the thread that connects, so it isn't ready until it responds
+	if not gearShifter.waitForResponse(gearShifterStartupTimeout):
+		raise TimeoutError(f'No response after {gearShifterStartupTimeout:.0f} s. Still trying to connect.')
+
+
+def startGps():
+	global isGpsConnected
+
+	showMessage('Connecting to GPS service...')
+	gpsd.connect()
+	time.sleep(1)
+	isGpsConnected = True
+
+
+def startDevicesInBackground():
+	"""
+	Starts ANT, the gear shifter and GPS all at the same time on other threads,
+	so that a slow device doesn't hold up the others or the main loop.
+	"""
+	global startupRemaining
+
+	steps = (('ANT', startAnt), ('Gear shifter', startGearShifter), ('GPS', startGps))
+	startupRemaining = len(steps)
+	pool = ThreadPoolExecutor(max_workers=len(steps), thread_name_prefix='Startup')
+	for name, function in steps:
+		future = pool.submit(timeStartupStep, name, function)
+		future.add_done_callback(lambda future, name=name: reportStartupStep(name, future))
+		startupFutures.append(future)
+	pool.shutdown(wait=False)  # Threads finish by themselves once their device has started
+
+
+def reportStartupStep(name, future):
+	"""
+	Shows on screen that a device has started, and logs all the startup times once the last one has.
+	"""
+	global startupRemaining
+
+	error = future.exception()
+	if error is not None:
+		showMessage(f'Could not start {name}.', error)
+	else:
+		showMessage(f'{name} ready after {getStartupTime(name):.1f} s')
+	with startupMutex:
+		startupRemaining -= 1
+		if startupRemaining == 0:
+			logStartupTimes()
+
+
+def waitForStartup():
+	"""
+	Waits for any devices still starting in the background, so that they can be stopped properly.
+	"""
+	wait(startupFutures)
+
+
+def timeStartupStep(name, function, *args):
+	"""
+	Calls a function and records how long it took, for the startup times in the log.
+	"""
+	startTime = time.monotonic()
+	result = function(*args)
+	startupTimes.append((name, time.monotonic() - startTime))
+	return result
+
+
+def getStartupTime(name):
+	return next((seconds for stepName, seconds in startupTimes if stepName == name), 0)
+
+
+def logStartupTimes():
+	steps = ', '.join(f'{name} {seconds:.2f} s' for name, seconds in startupTimes)
+	recording.log(f'Startup times: {steps}. Total {time.monotonic() - programStartTime:.2f} s')
+
+
+def setUpShutdownButton():
+	GPIO.setmode(GPIO.BCM)
+	GPIO.setup(shutdownPin, GPIO.IN)  # Pin includes a fixed 1.8 kΩ pull-up to 3.3v, so no need to set in software
 
-# Set up shutdown button
-shutdownPin = 3    # Physical/Board pin 5, GPIO/BCM pin 3
-GPIO.setmode(GPIO.BCM)
-GPIO.setup(shutdownPin, GPIO.IN)  # Pin includes a fixed 1.8 kΩ pull-up to 3.3v, so no need to set in software
 
 
 #-------------------------------------------------#
-#  Main loop                                      #
+#  Main loop tasks                                #
 #-------------------------------------------------#
 
-counter = 0
-isGpsActive = False
-shutdownHeld = False       # Track if shut-down button is held down
-shouldShutdown = False     # If terminating should also shut down the operating system
-hasAbortedBefore = False   # Track if shut down was aborted once already
-while True:
-	try:
-		# Check once a second if shut-down button is held down for 1 to 2 seconds.
-		if counter % 4 == 0:
-			if GPIO.input(shutdownPin) == GPIO.LOW:
-				if shutdownHeld:
-					shouldShutdown = True
-					raise KeyboardInterrupt
-				else:
-					showMessage('Shutdown button is pressed. Will shut down if it stays pressed.')
-					shutdownHeld = True
-			else:
-				shutdownHeld = False
+@profiling.timed
+def checkShutdownButton():
+	"""
+	Shuts down if the shut-down button is held down for 1 to 2 seconds. Called once a second.
+	"""
+	global shutdownHeld
+	global shouldShutdown
+
+	if GPIO.input(shutdownPin) == GPIO.LOW:
+		if shutdownHeld:
+			shouldShutdown = True
+			raise KeyboardInterrupt
+		else:
+			showMessage('Shutdown button is pressed. Will shut down if it stays pressed.')
+			shutdownHeld = True
+	else:
+		shutdownHeld = False
 
-		# Update the power info on display
-        # Disable for now.
-		#display.drawPower(power, config.powerGoal)
 
-		# Check to see if GPS is active. Give it some time to start up first.
-		if not isGpsActive and counter > 40 and counter % 8 == 0:
-			try:
+@profiling.timed
+def checkGpsFix():
+	"""
+	Checks to see if GPS is active.
+	"""
+	global isGpsActive
+
+	if isGpsConnected and not isGpsActive:
+		try:
+			with profiling.Timer('gpsd.get_current'):
 				info = gpsd.get_current()
-				if info.mode >= 2 and info.sats_valid:  # Check if it has a fix on position
-					isGpsActive = True
-			except Exception as gpsError:
-				showGpsMessage(str(gpsError), level='warning')
+			if info.mode >= 2 and info.sats_valid:  # Check if it has a fix on position
+				isGpsActive = True
+		except Exception as gpsError:
+			showGpsMessage(str(gpsError), level='warning')
 
-		# Get GPS info once a second after we have a fix
-		if isGpsActive and counter % 4 == 0:
-			try:
+
+@profiling.timed
+def updateGps():
+	"""
+	Gets GPS info once we have a fix, and updates the display.
+	"""
+	global isGpsActive
+
+	if isGpsActive:
+		try:
+			with profiling.Timer('gpsd.get_current'):
 				info = gpsd.get_current()
-				if info.mode >= 2 and info.sats_valid:  # Make sure we still have a fix
-					recording.writeGPS(info)
-					distanceToFinish = dist((info.lat, info.lon), config.finishPosition)
-					display.drawSpeedAndDistance(info.hspeed, distanceToFinish)
-				else:
-					display.drawSpeedAndDistance(None, None)
-					isGpsActive = False
-			except Exception as gpsError:
-				showGpsMessage(str(gpsError), level='error')
+			if info.mode >= 2 and info.sats_valid:  # Make sure we still have a fix
+				recording.writeGPS(info)
+				distanceToFinish = dist((info.lat, info.lon), config.finishPosition)
+				display.drawSpeedAndDistance(info.hspeed, distanceToFinish)
+			else:
+				display.drawSpeedAndDistance(None, None)
+				isGpsActive = False
+		except Exception as gpsError:
+			showGpsMessage(str(gpsError), level='error')
+
+
+@profiling.timed
+def checkCPUTemperature():
+	"""
+	Records the CPU temperature and load, and cuts back on work if it is getting too hot or busy.
+	"""
+	temperature = getCPUTemperature()
+	load = os.getloadavg()[0] / os.cpu_count()
+	if governor.addSample(temperature, load):
+		applyThrottleLevel(governor.level)
+	recording.writeCPUTemperature(temperature, load, governor.level)
+
+	if temperature > cpuWarnTemperature:
+		showHighTemperatureMessage(temperature)
+
 
-		# Update heart rate once a second
-		# Disable for now.
-		#if counter % 4 == 0:
-		#	display.drawHeartRate(heartRate)
+def applyThrottleLevel(level):
+	"""
+	Each level halves how often the tasks in throttledTaskNames run and recordings are written to file.
+	From level 2 the video is recorded at a lower quality.
+	"""
+	factor = 2 ** level
+	if mainTasks is not None:
+		for task in mainTasks.tasks:
+			if task.name in throttledTaskNames:
+				task.interval = task.baseInterval * factor
+	recording.flushInterval = normalFlushInterval * factor
+	try:
+		recording.changeVideoQuality(camera, max(level - 1, 0))
+	except Exception as error:
+		showMessage('Could not change video quality.', error)
+	showThrottleMessage(level)
 
-		# Read serial communication from gear shifter, and update display if necessary
-		gearData = readFromGearShifter()
-		if gearData is not None:
-			handleGearShifterComms(gearData)
 
-		# Check CPU temperature once every 8 second
-		if counter % 32 == 0:
-			temperature = getCPUTemperature()
+def checkVideoSplit():
+	"""
+	Starts a new video file if the current one is long or big enough.
+	Splitting waits for the next key frame, so it is done in the background.
+	"""
+	global videoSplitThread
 
-			## For diagnostics
-			#recording.writeCPUTemperature(temperature)
-			################
+	if camera is None or (videoSplitThread is not None and videoSplitThread.is_alive()):
+		return
+	if recording.isVideoSplitDue():
+		videoSplitThread = Thread(target=splitVideo, name='Video split', daemon=True)
+		videoSplitThread.start()
 
-			if temperature > cpuWarnTemperature:
-				showHighTemperatureMessage(temperature)
 
-		counter = counter + 1
+def splitVideo():
+	try:
+		recording.splitVideo(camera)
+	except Exception as error:
+		showMessage('Could not start a new video file.', error)
 
-		# NOTE: If this time is changed, all the modulo operands will have to be changed too.
-		time.sleep(0.250)  # 250ms
-	except KeyboardInterrupt:
+
+#-------------------------------------------------#
+#  Main loop                                      #
+#-------------------------------------------------#
+
+def makeTasks():
+	"""
+	:return: Scheduler with all the tasks that the main loop runs
+	"""
+	tasks = PeriodicScheduler()
+	tasks.addTask('Shutdown button', 1.0, checkShutdownButton)
+	tasks.addTask('GPS fix', 2.0, checkGpsFix, delay=10.0)  # Give GPS some time to start up first
+	tasks.addTask('GPS update', 1.0, updateGps)
+	# Update the power and heart rate info on display
+	# Disable for now.
+	# Use the 3 s average power, as the instantaneous power jumps around too much to read
+	#tasks.addTask('Power', 0.25, lambda: display.drawPower(powerStats.getMean(3) or 0, config.powerGoal))
+	#tasks.addTask('Heart rate', 1.0, lambda: display.drawHeartRate(heartRate))
+	tasks.addTask('CPU temperature', 2.0, checkCPUTemperature)
+	tasks.addTask('Video split', 1.0, checkVideoSplit)
+	tasks.addTask('Timing report', 1.0, checkTimingReport)
+	return tasks
+
+
+def runMainLoop(tasks):
+	"""
+	Runs the tasks until told to shut down.
+	"""
+	global shutdownHeld
+	global shouldShutdown
+	global hasAbortedBefore
+
+	while True:
 		try:
-			shutDownGearShifter()
-			stopRecordingVideo()
-			stopSensors()
-			break
-		except Exception as e:
-			if hasAbortedBefore:
-				showMessage('Shutdown failed again but shutting down anyway.', e)
+			tasks.runNext()
+		except KeyboardInterrupt:
+			try:
+				waitForStartup()
+				shutDownGearShifter()
+				stopRecordingVideo()
+				stopSensors()
 				break
-			else:
-				hasAbortedBefore = True
-				shutdownHeld = False
-				shouldShutdown = False
-				showMessage('Shutdown aborted due to error.', e)
-
+			except Exception as e:
+				if hasAbortedBefore:
+					showMessage('Shutdown failed again but shutting down anyway.', e)
+					break
+				else:
+					hasAbortedBefore = True
+					shutdownHeld = False
+					shouldShutdown = False
+					showMessage('Shutdown aborted due to error.', e)
 
-if shouldShutdown:
-	showMessage('Shutting down...')
-	time.sleep(1.0)
 
-display.stop()
-recording.log('All done.')
-recording.closeFiles()
-GPIO.cleanup(shutdownPin)
 
-if shouldShutdown:
-	os.system('sudo shutdown -h now')
+if __name__ == '__main__':
+	startupTimes.append(('imports', time.monotonic() - programStartTime))
+	timeStartupStep('files', recording.openFiles)
+	try:
+		signal.signal(signal.SIGUSR1, requestTimingReport)
+		timeStartupStep('camera', startCamera)
+		recording.log(f'Camera preview started {time.monotonic() - programStartTime:.2f} s after start')
+		startDevicesInBackground()
+
+		timeStartupStep('display', display.drawSpeedAndDistance, None, None)
+		timeStartupStep('video recording', recording.startRecordingVideo, camera)
+		timeStartupStep('shutdown button', setUpShutdownButton)
+
+		mainTasks = makeTasks()
+		runMainLoop(mainTasks)
+
+		if shouldShutdown:
+			showMessage('Shutting down...')
+			time.sleep(1.0)
+
+		for stats in mainTasks.getStats():
+			recording.log(stats)
+		recording.log(powerStats.getSummary())
+		recording.log(heartRateStats.getSummary())
+		for eventFilter in (heartRateEvents, powerEvents, torqueEvents):
+			recording.log(str(eventFilter))
+		display.stop()
+		recording.log('All done.')
+	except Exception:
+		recording.log('Stopped due to an error.\n' + traceback.format_exc())
+		raise
+	finally:
+		# The writer thread is a daemon, so close the files whatever happens, or anything still queued is lost
+		recording.closeFiles(stats={
+			'power': powerStats.getSummary(),
+			'heartRate': heartRateStats.getSummary()
+		})
+	GPIO.cleanup(shutdownPin)
+
+	if shouldShutdown:
+		os.system('sudo shutdown -h now')
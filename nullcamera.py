@@ -0,0 +1,39 @@
+"""
+
+  Stand-in for the Pi camera, for drawing the display without a camera or screen, e.g. for benchmarks and simulations.
+
+"""
+
+
+class NullCamera:
+	"""
+	Camera that doesn't show anything, but counts how much data is sent to its overlays.
+	"""
+	def __init__(self):
+		self.overlays = []
+		self.bytesPushed = 0
+
+	def start_preview(self, **options):
+		pass
+
+	def stop_preview(self):
+		pass
+
+	def add_overlay(self, imageBytes, window=None, **options):
+		self.bytesPushed += len(imageBytes)
+		overlay = NullOverlay(self, window)
+		self.overlays.append(overlay)
+		return overlay
+
+	def remove_overlay(self, overlay):
+		self.overlays.remove(overlay)
+
+
+class NullOverlay:
+	def __init__(self, camera, window):
+		self.camera = camera
+		self.window = window
+		self.alpha = 255
+
+	def update(self, imageBytes):
+		self.camera.bytesPushed += len(imageBytes)
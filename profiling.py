@@ -0,0 +1,107 @@
+"""
+
+  Timing of the functions that run most often, to find out what is slowing things down
+
+"""
+
+import functools
+import json
+import time
+from threading import Lock
+
+import config
+
+
+isEnabled = config.profilingEnabled
+allStats = {}      # TimingStats for each name
+statsMutex = Lock()
+
+
+class TimingStats:
+	"""
+	Count, total and histogram of how long something takes.
+	The histogram has a bucket for each power of 2 microseconds.
+	"""
+	def __init__(self, name):
+		self.name = name
+		self.count = 0
+		self.totalNs = 0
+		self.maxNs = 0
+		self.buckets = [0] * 32  # Bucket n counts times of less than 2^n microseconds
+
+	def add(self, durationNs):
+		bucket = min((durationNs // 1000).bit_length(), len(self.buckets) - 1)
+		with statsMutex:
+			self.count += 1
+			self.totalNs += durationNs
+			if durationNs > self.maxNs:
+				self.maxNs = durationNs
+			self.buckets[bucket] += 1
+
+	def toDict(self):
+		lastBucket = max((i for i, count in enumerate(self.buckets) if count), default=-1)
+		return {
+			'count': self.count,
+			'totalMs': self.totalNs / 1e6,
+			'meanMs': self.totalNs / self.count / 1e6 if self.count else 0,
+			'maxMs': self.maxNs / 1e6,
+			'histogram': {f'<{2**i}us': self.buckets[i] for i in range(lastBucket + 1)}
+		}
+
+
+class Timer:
+	"""
+	Context manager that times the code inside it. For example:
+		with profiling.Timer('GPS query'):
+			info = gpsd.get_current()
+	"""
+	def __init__(self, name):
+		self.stats = getStats(name)
+		self.startTime = 0
+
+	def __enter__(self):
+		if isEnabled:
+			self.startTime = time.perf_counter_ns()
+		return self
+
+	def __exit__(self, excType, excValue, traceback):
+		if isEnabled and self.startTime:
+			self.stats.add(time.perf_counter_ns() - self.startTime)
+		return False
+
+
+def timed(function):
+	"""
+	Decorator that times every call to a function, named after the module and function.
+	"""
+	moduleName = 'main' if function.__module__ == '__main__' else function.__module__
+	stats = getStats(moduleName + '.' + function.__name__)
+
+	@functools.wraps(function)
+	def wrapper(*args, **kwargs):
+		if not isEnabled:
+			return function(*args, **kwargs)
+		startTime = time.perf_counter_ns()
+		try:
+			return function(*args, **kwargs)
+		finally:
+			stats.add(time.perf_counter_ns() - startTime)
+	return wrapper
+
+
+def getStats(name):
+	with statsMutex:
+		stats = allStats.get(name)
+		if stats is None:
+			stats = allStats[name] = TimingStats(name)
+		return stats
+
+
+def writeReport(path):
+	"""
+	Writes the timings of everything that has been called at least once to a JSON file.
+	"""
+	with statsMutex:
+		report = {name: stats.toDict() for name, stats in sorted(allStats.items()) if stats.count}
+	with open(path, 'w', encoding='utf-8') as file:
+		json.dump(report, file, indent='\t')
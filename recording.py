@@ -5,8 +5,17 @@
 """
 
 import os
+import json
+import math
+import struct
+import time
+from queue import Queue, Full, Empty
+from threading import Thread, RLock
 from datetime import datetime, timezone
 
+import config
+import profiling
+
 
 baseDir = './data/'
 logFileName = 'log.txt'
@@ -15,44 +24,165 @@ powerFileName = 'power.csv'
 torqueFileName = 'torque.csv'
 gpsFileName = 'gps.csv'
 videoFileName = 'video.h264'
+sessionFileName = 'session.json'
+timingFileName = 'timing.json'
 cpuTemperatureFileName = 'cpu_temperature.csv'
+catalogueFileName = 'catalogue.json'  # In baseDir. Lists all the sessions, so that they don't need to be searched for.
 currentDir = None
+sessionName = None          # Number of the current session, as a string. Same as the name of its directory.
+sessionStartTime = None     # UTC date and time that the session clock was started
+sessionStartNs = 0          # time.monotonic_ns() when the session clock was started
+sessionStartSecondOfDay = 0.0
+videoStartOffset = None     # Session time that video recording started
+videoFiles = []             # Name, start time and settings of each video file recorded in this session
+# Resolution and bit rate to record video at. Lower qualities are used when the CPU needs less work to do.
+videoQualities = [
+	((648, 365), 1000000),  # Half width and height of the mode 5 resolution
+	((480, 270), 600000),
+]
+videoQuality = 0
 logFile = None
 heartRateFile = None
 powerFile = None
 torqueFile = None
 gpsFile = None
 cpuTemperatureFile = None
+isBinary = False
+binaryFileExtension = '.bin'
+binaryFileMagic = b'BIKEMON1'
+# Field names and struct format codes of each record, for when recording in binary format.
+# Session time is seconds since the session started.
+heartRateFields = [('sessionTime', 'd'), ('eventTime', 'd'), ('heartRate', 'H')]
+powerFields = [('sessionTime', 'd'), ('eventCount', 'H'), ('instantaneousPower', 'H'), ('accumulatedPower', 'I'), ('ratio', 'f'), ('cadence', 'f')]
+torqueFields = [('sessionTime', 'd'), ('eventCount', 'H'), ('leftTorque', 'f'), ('rightTorque', 'f'), ('leftPedalSmoothness', 'f'), ('rightPedalSmoothness', 'f')]
+gpsFields = [('sessionTime', 'd'), ('time', 'd'), ('latitude', 'd'), ('longitude', 'd'), ('latitudePrecision', 'f'), ('longitudePrecision', 'f'), ('speed', 'f'), ('speedPrecision', 'f')]
+heartRateStruct = struct.Struct('<' + ''.join(code for name, code in heartRateFields))
+powerStruct = struct.Struct('<' + ''.join(code for name, code in powerFields))
+torqueStruct = struct.Struct('<' + ''.join(code for name, code in torqueFields))
+gpsStruct = struct.Struct('<' + ''.join(code for name, code in gpsFields))
+# Index of the frames in each video file, in the same binary format. Position is the byte offset of the frame in the file.
+videoIndexFields = [('frame', 'I'), ('sessionTime', 'd'), ('position', 'Q'), ('isKeyFrame', 'B')]
+videoIndexStruct = struct.Struct('<' + ''.join(code for name, code in videoIndexFields))
+videoOutput = None          # IndexedVideoOutput that the camera is recording to
+videoMutex = RLock()        # Held while starting, stopping or splitting the video recording
+writeQueueSize = 2000       # Max number of rows waiting to be written. Rows are dropped if it is full.
+flushInterval = 2.0         # Max seconds to keep rows in memory before writing them to file.
+flushSize = 16384           # Write to file once this many characters are waiting for a file.
+writeQueue = None
+writerThread = None
+droppedRowCount = 0
+lastWriteLatency = 0.0      # Seconds taken by the most recent write to file.
+maxWriteLatency = 0.0
 
 
 def openFiles():
 	global currentDir
+	global sessionName
 	global logFile
 	global heartRateFile
 	global powerFile
 	global torqueFile
 	global gpsFile
 	global cpuTemperatureFile
+	global isBinary
 
 	os.makedirs(baseDir, exist_ok=True)
-	currentDir = makeUniqueDir(baseDir)
+	catalogue = readCatalogue(baseDir)
+	currentDir = makeUniqueDir(baseDir, catalogue['nextNumber'])
+	sessionName = os.path.basename(os.path.normpath(currentDir))
+	startSessionClock()
+	writeSessionInfo()
+	# Add the session now, so that the number is used up even if the session is never closed properly
+	catalogue['nextNumber'] = int(sessionName) + 1
+	catalogue['sessions'][sessionName] = {'startTime': sessionStartTime.isoformat()}
+	writeCatalogue(baseDir, catalogue)
 
 	logFile = open(currentDir + logFileName, 'w', encoding='utf-8')
+	isBinary = config.recordingFormat == 'binary'
+	if isBinary:
+		heartRateFile = openBinaryFile(heartRateFileName, heartRateFields)
+		powerFile = openBinaryFile(powerFileName, powerFields)
+		torqueFile = openBinaryFile(torqueFileName, torqueFields)
+		gpsFile = openBinaryFile(gpsFileName, gpsFields)
+	else:
+		openTextFiles()
+
+	cpuTemperatureFile = open(currentDir + cpuTemperatureFileName, 'w', encoding='utf-8')
+	cpuTemperatureFile.write('Session Time (s),CPU Temperature (°C),CPU Load,Throttle Level\n')
+
+	startWriter()
+
+
+def openTextFiles():
+	global heartRateFile
+	global powerFile
+	global torqueFile
+	global gpsFile
+
 	heartRateFile = open(currentDir + heartRateFileName, 'w', encoding='utf-8')
-	heartRateFile.write('Time,Heart Rate (bpm)\n')
+	heartRateFile.write('Session Time (s),Event Time (s),Heart Rate (bpm)\n')
 	powerFile = open(currentDir + powerFileName, 'w', encoding='utf-8')
-	powerFile.write('Time,Instantaneous Power (W),Accumulated Power (W),Pedal Right/Left Power Ratio,Cadence (rpm)\n')
+	powerFile.write('Session Time (s),Event Count,Instantaneous Power (W),Accumulated Power (W),Pedal Right/Left Power Ratio,Cadence (rpm)\n')
 	torqueFile = open(currentDir + torqueFileName, 'w', encoding='utf-8')
-	torqueFile.write('Time,Torque Effectiveness,,Pedal Smoothness,\n')
-	torqueFile.write(',left,right,left,right\n')
+	torqueFile.write('Session Time (s),Event Count,Torque Effectiveness,,Pedal Smoothness,\n')
+	torqueFile.write(',,left,right,left,right\n')
 	gpsFile = open(currentDir + gpsFileName, 'w', encoding='utf-8')
-	gpsFile.write('Time (UTC),Latitude,Longitude,Latitude Precision (m),Longitude Precision (m),Speed (m/s),Speed Precision\n')
+	gpsFile.write('Session Time (s),Time (UTC),Latitude,Longitude,Latitude Precision (m),Longitude Precision (m),Speed (m/s),Speed Precision\n')
+
 
-	## For diagnostics
-	#cpuTemperatureFile = open(currentDir + cpuTemperatureFileName, 'w', encoding='utf-8')
-	################
+def openBinaryFile(fileName, fields):
+	"""
+	Creates a file for recording in binary format, and writes the header describing the records in it.
+	The header is the magic bytes, then the length of the JSON description, then the JSON description
+	padded so that the records start on an 8 byte boundary.
+
+	:param fileName: Name of the file, extension will be replaced
+	:param fields: List of (name, struct format code) for each field in a record
+	:return: The file object
+	"""
+	name = os.path.splitext(fileName)[0]
+	description = json.dumps({'stream': name, 'byteOrder': '<', 'fields': fields}).encode('utf-8')
+	headerLength = len(binaryFileMagic) + 4 + len(description)
+	description += b' ' * (-headerLength % 8)
+	file = open(currentDir + name + binaryFileExtension, 'wb')
+	file.write(binaryFileMagic)
+	file.write(struct.pack('<I', len(description)))
+	file.write(description)
+	return file
 
-def closeFiles():
+
+def readBinaryFile(path):
+	"""
+	Reads a file that was recorded in binary format.
+	Needs NumPy, which is not required for recording.
+
+	:param path: Path to the file
+	:return: NumPy structured array of records, with a field for each field in the file.
+	         The array is memory-mapped, so the file is not read until the data is used.
+	"""
+	import numpy
+
+	with open(path, 'rb') as file:
+		if file.read(len(binaryFileMagic)) != binaryFileMagic:
+			raise ValueError(f'{path} is not a binary recording file')
+		descriptionLength, = struct.unpack('<I', file.read(4))
+		description = json.loads(file.read(descriptionLength).decode('utf-8'))
+	byteOrder = description['byteOrder']
+	dtype = numpy.dtype([(name, byteOrder + code) for name, code in description['fields']])
+	offset = len(binaryFileMagic) + 4 + descriptionLength
+	count = (os.path.getsize(path) - offset) // dtype.itemsize  # Ignore any partly written record at the end
+	if count == 0:
+		return numpy.zeros(0, dtype=dtype)
+	return numpy.memmap(path, dtype=dtype, mode='r', offset=offset, shape=(count,))
+
+
+def closeFiles(stats=None):
+	"""
+	:param stats: Dictionary of statistics from the session to save in the catalogue
+	"""
+	duration = getSessionTime()
+	stopWriter()
+	profiling.writeReport(currentDir + timingFileName)
 	logFile.close()
 	heartRateFile.close()
 	powerFile.close()
@@ -62,14 +192,90 @@ def closeFiles():
 	if cpuTemperatureFile:
 		cpuTemperatureFile.close()
 
+	updateCatalogue(baseDir, sessionName, duration=round(duration, 3), fileSizes=getFileSizes(currentDir), stats=stats)
 
-def makeUniqueDir(base):
+
+def readCatalogue(base):
+	"""
+	Reads the catalogue of sessions in a base directory. If it is missing or damaged, it is rebuilt from the
+	session directories.
+
+	:return: Dictionary with the next session number, and a dictionary of information about each session
+	"""
+	try:
+		with open(base + catalogueFileName, encoding='utf-8') as file:
+			catalogue = json.load(file)
+		if isinstance(catalogue.get('nextNumber'), int) and isinstance(catalogue.get('sessions'), dict):
+			return catalogue
+	except (OSError, ValueError):
+		pass
+	return rebuildCatalogue(base)
+
+
+def rebuildCatalogue(base):
+	"""
+	Makes a catalogue by looking in each session directory. Durations and statistics are not known.
+	"""
+	sessions = {}
+	try:
+		names = sorted(name for name in os.listdir(base) if name.isdigit() and os.path.isdir(base + name))
+	except FileNotFoundError:
+		names = []
+	for name in names:
+		session = {}
+		try:
+			with open(base + name + '/' + sessionFileName, encoding='utf-8') as file:
+				session['startTime'] = json.load(file).get('startTime')
+		except (OSError, ValueError):
+			pass
+		session['fileSizes'] = getFileSizes(base + name)
+		sessions[name] = session
+	return {
+		'nextNumber': max((int(name) for name in names), default=0) + 1,
+		'sessions': sessions
+	}
+
+
+def writeCatalogue(base, catalogue):
+	"""
+	Writes the catalogue to a temporary file and then replaces the old one with it,
+	so that the catalogue is never left half written.
+	"""
+	path = base + catalogueFileName
+	with open(path + '.tmp', 'w', encoding='utf-8') as file:
+		json.dump(catalogue, file, indent='\t')
+		file.flush()
+		os.fsync(file.fileno())
+	os.replace(path + '.tmp', path)
+
+
+def updateCatalogue(base, name, **values):
+	"""
+	Changes the information about one session in the catalogue.
+
+	:param name: Name of the session's directory, e.g. '001'
+	:param values: Values to set for the session
+	"""
+	catalogue = readCatalogue(base)
+	catalogue['sessions'].setdefault(name, {}).update(values)
+	writeCatalogue(base, catalogue)
+
+
+def getFileSizes(directory):
+	"""
+	:return: Dictionary of the size in bytes of each file in a directory
+	"""
+	with os.scandir(directory) as entries:
+		return {entry.name: entry.stat().st_size for entry in entries if entry.is_file()}
+
+
+def makeUniqueDir(base, num=1):
 	"""
 	Creates a new directory with a unique number as it's name.
 	:param base: The base directory to create it in
+	:param num: Number to try first, e.g. the next number from the catalogue
 	:return: The full path to the new directory
 	"""
-	num = 1
 	while True:
 		try:
 			numString = '{:0>3d}'.format(num)
@@ -79,78 +285,353 @@ def makeUniqueDir(base):
 			num = num + 1
 
 
-def startRecordingVideo(camera):
-	# Resolution is half width and height of the mode 5 resolution
-	camera.start_recording(currentDir + videoFileName, format='h264', resize=(648, 365), bitrate=1000000)
+def startRecordingVideo(camera, quality=0):
+	"""
+	:param quality: Index into videoQualities
+	"""
+	global videoQuality
+	global videoOutput
+
+	with videoMutex:
+		resolution, bitRate = videoQualities[quality]
+		videoOutput = IndexedVideoOutput(camera, makeVideoFileName())
+		camera.start_recording(videoOutput, format='h264', resize=resolution, bitrate=bitRate)
+		videoQuality = quality
+		addVideoFile(videoOutput)
+
+
+def changeVideoQuality(camera, quality):
+	"""
+	Changes the resolution and bit rate of the video being recorded. This starts a new video file.
+	Old files are deleted if only the last few are to be kept.
+
+	:param quality: Index into videoQualities
+	"""
+	quality = min(quality, len(videoQualities) - 1)
+	with videoMutex:
+		if quality != videoQuality and videoOutput is not None:
+			stopRecordingVideo(camera)
+			startRecordingVideo(camera, quality)
+			log(f'Changed video quality to {videoQualities[quality]} in {videoFiles[-1]["file"]}')
+			if config.videoSegmentsKept:
+				deleteOldVideoFiles(config.videoSegmentsKept)
+
+
+def splitVideo(camera):
+	"""
+	Carries on recording video into a new file. The camera switches files at the next key frame, so this can take
+	a second or so. Old files are deleted if only the last few are to be kept.
+	"""
+	global videoOutput
+
+	with videoMutex:
+		if videoOutput is None:
+			return
+		oldOutput = videoOutput
+		videoOutput = IndexedVideoOutput(camera, makeVideoFileName())
+		camera.split_recording(videoOutput)
+		oldOutput.close()
+		addVideoFile(videoOutput)
+		if config.videoSegmentsKept:
+			deleteOldVideoFiles(config.videoSegmentsKept)
+
+
+def isVideoSplitDue():
+	"""
+	:return: True if the current video file is longer or bigger than a segment should be
+	"""
+	if videoOutput is None or not videoFiles:
+		return False
+	return ((config.videoSegmentDuration and getSessionTime() - videoFiles[-1]['startOffset'] >= config.videoSegmentDuration)
+	        or (config.videoSegmentSize and videoOutput.position >= config.videoSegmentSize * 1000000))
+
+
+def makeVideoFileName():
+	"""
+	:return: video.h264 for the first file, and video-2.h264 and so on for any after that
+	"""
+	if not videoFiles:
+		return videoFileName
+	name, extension = os.path.splitext(videoFileName)
+	return f'{name}-{len(videoFiles) + 1}{extension}'
+
+
+def addVideoFile(output):
+	"""
+	Adds a new video file to the session info.
+	"""
+	global videoStartOffset
+
+	startOffset = getSessionTime()
+	if videoStartOffset is None:
+		videoStartOffset = startOffset
+	resolution, bitRate = videoQualities[videoQuality]
+	videoFiles.append({'file': output.fileName, 'index': output.indexFileName, 'startOffset': startOffset,
+	                   'resolution': resolution, 'bitRate': bitRate})
+	writeSessionInfo()
+
+
+def deleteOldVideoFiles(keepCount):
+	"""
+	Deletes all but the last few video files and their indexes. They stay in the session info, marked as deleted.
+
+	:param keepCount: Number of files to keep, including the one being recorded
+	"""
+	for videoFile in videoFiles[:-keepCount]:
+		if videoFile.get('deleted'):
+			continue
+		for fileName in (videoFile['file'], videoFile['index']):
+			try:
+				os.remove(currentDir + fileName)
+			except FileNotFoundError:
+				pass
+		videoFile['deleted'] = True
+		log(f'Deleted old video file {videoFile["file"]}')
+	writeSessionInfo()
 
 
 def stopRecordingVideo(camera):
-	camera.stop_recording()
+	global videoOutput
+
+	with videoMutex:
+		camera.stop_recording()
+		if videoOutput is not None:
+			videoOutput.close()
+			videoOutput = None
+
+
+class IndexedVideoOutput:
+	"""
+	Output for camera.start_recording that writes the video to file, along with an index of the session time and
+	byte position of each frame. The index is in binary format with videoIndexFields, and can be read with
+	videoindex.VideoIndex.
+
+	The camera calls write from its encoder thread, with one or more buffers for each frame.
+	camera.frame describes the frame that the buffer belongs to.
+	Relies on camera.clock_mode being 'raw', so that frame timestamps use the same clock as camera.timestamp.
+	By default they start again from zero with each recording.
+	"""
+	def __init__(self, camera, fileName):
+		"""
+		:param fileName: Name of the video file in the session directory
+		"""
+		self.camera = camera
+		self.fileName = fileName
+		self.file = open(currentDir + fileName, 'wb')
+		self.indexFile = openBinaryFile(fileName, videoIndexFields)
+		self.indexFileName = os.path.basename(self.indexFile.name)
+		self.position = 0       # Bytes written so far
+		self.framePosition = 0  # Position that the current frame started at
+		self.frameCount = 0
+		# Frame timestamps are in microseconds on the camera's clock. This converts them to session time.
+		self.clockOffset = getSessionTime() - camera.timestamp / 1e6
+
+	def write(self, data):
+		self.file.write(data)
+		self.position += len(data)
+		frame = self.camera.frame
+		if frame is not None and frame.complete:
+			# SPS headers have no timestamp. Count them as part of the key frame that follows, so that playback
+			# can start from the key frame's position.
+			if frame.timestamp is not None:
+				self.indexFile.write(videoIndexStruct.pack(self.frameCount, frame.timestamp / 1e6 + self.clockOffset,
+				                                           self.framePosition, frame.keyframe))
+				self.frameCount += 1
+				self.framePosition = self.position
+		return len(data)
+
+	def flush(self):
+		self.file.flush()
+		self.indexFile.flush()
+
+	def close(self):
+		self.file.close()
+		self.indexFile.close()
 
 
+def getSessionTime():
+	"""
+	:return: Seconds since the session started, from a clock that is not affected by changes to the system time.
+	"""
+	return (time.monotonic_ns() - sessionStartNs) / 1e9
+
+
+@profiling.timed
 def log(message):
-	currentTime = datetime.now(timezone.utc).time()
-	logFile.write(currentTime.strftime('%H:%M:%S.%f')[:-3])
-	logFile.write('   ')
-	logFile.write(message)
-	logFile.write('\n')
-	logFile.flush()
+	# Work out the time of day from the session clock, which is quicker than datetime.now().strftime()
+	milliseconds = int((sessionStartSecondOfDay + getSessionTime()) * 1000) % 86400000
+	seconds, milliseconds = divmod(milliseconds, 1000)
+	minutes, seconds = divmod(seconds, 60)
+	hours, minutes = divmod(minutes, 60)
+	queueRow(logFile, f'{hours:02d}:{minutes:02d}:{seconds:02d}.{milliseconds:03d}   {message}\n')
 
 
+@profiling.timed
 def writeHeartRateEvent(eventTime, heartRate):
-	heartRateFile.write(str(eventTime))
-	heartRateFile.write(',')
-	heartRateFile.write(str(heartRate))
-	heartRateFile.write('\n')
-	heartRateFile.flush()
-
-
-def writePowerEvent(eventTime, instantaneousPower, accumulatedPower, ratio, cadence):
-	powerFile.write(str(eventTime))
-	powerFile.write(',')
-	powerFile.write(str(instantaneousPower))
-	powerFile.write(',')
-	powerFile.write(str(accumulatedPower))
-	powerFile.write(',')
-	powerFile.write(str(ratio))
-	powerFile.write(',')
-	powerFile.write(str(cadence))
-	powerFile.write('\n')
-	powerFile.flush()
-
-
-def writeTorqueEvent(eventTime, leftTorque, rightTorque, leftPedalSmoothness, rightPedalSmoothness):
-	torqueFile.write(str(eventTime))
-	torqueFile.write(',')
-	torqueFile.write(str(leftTorque))
-	torqueFile.write(',')
-	torqueFile.write(str(rightTorque))
-	torqueFile.write(',')
-	torqueFile.write(str(leftPedalSmoothness))
-	torqueFile.write(',')
-	torqueFile.write(str(rightPedalSmoothness))
-	torqueFile.write('\n')
-	torqueFile.flush()
+	sessionTime = getSessionTime()
+	if isBinary:
+		queueRow(heartRateFile, heartRateStruct.pack(sessionTime, eventTime, heartRate))
+	else:
+		queueRow(heartRateFile, f'{sessionTime:.3f},{eventTime},{heartRate}\n')
+
 
+@profiling.timed
+def writePowerEvent(eventCount, instantaneousPower, accumulatedPower, ratio, cadence):
+	sessionTime = getSessionTime()
+	if isBinary:
+		queueRow(powerFile, powerStruct.pack(sessionTime, eventCount, instantaneousPower, accumulatedPower, toFloat(ratio), toFloat(cadence)))
+	else:
+		queueRow(powerFile, f'{sessionTime:.3f},{eventCount},{instantaneousPower},{accumulatedPower},{ratio},{cadence}\n')
 
+
+@profiling.timed
+def writeTorqueEvent(eventCount, leftTorque, rightTorque, leftPedalSmoothness, rightPedalSmoothness):
+	sessionTime = getSessionTime()
+	if isBinary:
+		queueRow(torqueFile, torqueStruct.pack(sessionTime, eventCount, toFloat(leftTorque), toFloat(rightTorque),
+		                                       toFloat(leftPedalSmoothness), toFloat(rightPedalSmoothness)))
+	else:
+		queueRow(torqueFile, f'{sessionTime:.3f},{eventCount},{leftTorque},{rightTorque},{leftPedalSmoothness},{rightPedalSmoothness}\n')
+
+
+@profiling.timed
 def writeGPS(info):
-	gpsFile.write(str(info.get_time()))
-	gpsFile.write(',')
-	gpsFile.write(str(info.lat))
-	gpsFile.write(',')
-	gpsFile.write(str(info.lon))
-	gpsFile.write(',')
-	gpsFile.write(str(info.error['y']))
-	gpsFile.write(',')
-	gpsFile.write(str(info.error['x']))
-	gpsFile.write(',')
-	gpsFile.write(str(info.hspeed))
-	gpsFile.write(',')
-	gpsFile.write(str(info.error['s']))
-	gpsFile.write('\n')
-	gpsFile.flush()
-
-
-def writeCPUTemperature(temperature):
-	cpuTemperatureFile.write(str(temperature))
-	cpuTemperatureFile.write('\n')
+	sessionTime = getSessionTime()
+	if isBinary:
+		queueRow(gpsFile, gpsStruct.pack(sessionTime, info.get_time().timestamp(), info.lat, info.lon, info.error['y'],
+		                                 info.error['x'], info.hspeed, info.error['s']))
+	else:
+		queueRow(gpsFile, f'{sessionTime:.3f},{info.get_time()},{info.lat},{info.lon},{info.error["y"]},{info.error["x"]},{info.hspeed},{info.error["s"]}\n')
+
+
+@profiling.timed
+def writeCPUTemperature(temperature, load, throttleLevel):
+	queueRow(cpuTemperatureFile, f'{getSessionTime():.3f},{temperature},{load:.2f},{throttleLevel}\n')
+
+
+
+### Private methods ###
+
+def startSessionClock():
+	"""
+	Starts the clock used to time-stamp everything recorded in this session.
+	The monotonic clock is anchored to the current UTC time so that session times can be converted to real times.
+	"""
+	global sessionStartTime
+	global sessionStartNs
+	global sessionStartSecondOfDay
+	global videoStartOffset
+
+	sessionStartNs = time.monotonic_ns()
+	sessionStartTime = datetime.now(timezone.utc)
+	midnight = sessionStartTime.replace(hour=0, minute=0, second=0, microsecond=0)
+	sessionStartSecondOfDay = (sessionStartTime - midnight).total_seconds()
+	videoStartOffset = None
+	videoFiles.clear()
+
+
+def writeSessionInfo():
+	"""
+	Writes information needed to line up the recorded files with each other.
+	"""
+	info = {
+		'startTime': sessionStartTime.isoformat(),
+		'videoStartOffset': videoStartOffset,
+		'videoFiles': videoFiles
+	}
+	with open(currentDir + sessionFileName, 'w', encoding='utf-8') as file:
+		json.dump(info, file, indent='\t')
+
+
+def startWriter():
+	global writeQueue
+	global writerThread
+
+	writeQueue = Queue(maxsize=writeQueueSize)
+	writerThread = Thread(target=writeRows, name='Recording writer', daemon=True)
+	writerThread.start()
+
+
+def stopWriter():
+	"""
+	Writes out everything that is waiting to be written, then stops the writer thread.
+	"""
+	global writerThread
+
+	if writerThread is not None:
+		writeQueue.put((None, None))  # Blocks if full, so nothing is dropped
+		writerThread.join()
+		writerThread = None
+
+
+def queueRow(file, row):
+	"""
+	Adds a row of text to be written to file by the writer thread.
+	Does not block. If too many rows are waiting, the row is dropped.
+	"""
+	global droppedRowCount
+
+	try:
+		writeQueue.put_nowait((file, row))
+	except Full:
+		droppedRowCount = droppedRowCount + 1
+
+
+def toFloat(value):
+	"""
+	Converts a value that might be missing to a float for binary records. Missing values become NaN.
+	"""
+	return math.nan if value is None or value == '' else float(value)
+
+
+def getQueueDepth():
+	"""
+	:return: Number of rows waiting to be written
+	"""
+	return 0 if writeQueue is None else writeQueue.qsize()
+
+
+def writeRows():
+	"""
+	Runs on the writer thread. Collects rows for each file and writes them out in batches.
+	"""
+	pendingRows = {}   # List of rows waiting for each file
+	pendingSizes = {}  # Number of characters waiting for each file
+	nextFlushTime = time.monotonic() + flushInterval
+	isStopping = False
+	while not isStopping:
+		try:
+			file, row = writeQueue.get(timeout=max(nextFlushTime - time.monotonic(), 0))
+			if file is None:
+				isStopping = True
+			else:
+				pendingRows.setdefault(file, []).append(row)
+				pendingSizes[file] = pendingSizes.get(file, 0) + len(row)
+				if pendingSizes[file] >= flushSize:
+					writePendingRows(file, pendingRows.pop(file))
+					del pendingSizes[file]
+		except Empty:
+			pass
+
+		if isStopping or time.monotonic() >= nextFlushTime:
+			for file, rows in pendingRows.items():
+				writePendingRows(file, rows)
+			pendingRows.clear()
+			pendingSizes.clear()
+			nextFlushTime = time.monotonic() + flushInterval
+
+
+@profiling.timed
+def writePendingRows(file, rows):
+	global droppedRowCount
+	global lastWriteLatency
+	global maxWriteLatency
+
+	startTime = time.monotonic()
+	try:
+		file.write(b''.join(rows) if isinstance(rows[0], bytes) else ''.join(rows))
+		file.flush()
+	except OSError:
+		droppedRowCount = droppedRowCount + len(rows)
+	lastWriteLatency = time.monotonic() - startTime
+	maxWriteLatency = max(maxWriteLatency, lastWriteLatency)
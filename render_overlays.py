@@ -0,0 +1,279 @@
+"""
+
+  Renders the on-bike display for a recorded session, for laying over the video afterwards.
+  Uses the same drawing functions as the live display. Needs NumPy, which is not required for recording.
+
+  Usage: python3 render_overlays.py <session directory> (--png DIR | --raw) [--fps N] [--processes N]
+
+  Frames are at the display resolution, one for each recorded video frame, or at a fixed rate if there is no video index.
+  With --raw, RGBA frames are written to standard output, e.g. for ffmpeg:
+    python3 render_overlays.py data/001 --raw | ffmpeg -f rawvideo -pix_fmt rgba -s 1920x1080 -r 49 -i - ...
+
+"""
+
+import json
+import os
+import shutil
+import sys
+import time
+from datetime import datetime
+from multiprocessing import Pool
+
+import numpy
+from PIL import Image
+
+import analysis
+import config
+import display
+import recording
+from nullcamera import NullCamera, NullOverlay
+from videoindex import VideoIndex
+
+
+powerAverageTime = 3.0  # Seconds. Same as the power shown by main.
+maxGpsGap = 2.0         # Seconds without a GPS update before the speed is shown as unknown
+missing = -1            # Value in a frame state for an overlay with nothing to show yet
+renderCamera = None     # CaptureCamera of each worker process
+
+
+class CaptureCamera(NullCamera):
+	"""
+	Camera that keeps the latest image of each overlay, so that they can be combined into a frame.
+	"""
+	def add_overlay(self, imageBytes, window=None, **options):
+		overlay = CaptureOverlay(self, window, options.get('size'))
+		overlay.update(imageBytes)
+		self.overlays.append(overlay)
+		return overlay
+
+	def makeFrame(self):
+		"""
+		:return: RGBA image of all the visible overlays, at the display resolution
+		"""
+		frame = Image.new('RGBA', config.videoDisplayResolution)
+		for overlay in self.overlays:
+			if overlay.alpha > 0 and overlay.image is not None:
+				frame.alpha_composite(overlay.image, overlay.window[0:2])
+		return frame
+
+
+class CaptureOverlay(NullOverlay):
+	def __init__(self, camera, window, size):
+		super().__init__(camera, window)
+		self.size = size
+		self.image = None
+
+	def update(self, imageBytes):
+		super().update(imageBytes)
+		self.image = Image.frombytes('RGBA', self.size, imageBytes)
+
+	def clear(self):
+		"""
+		Hides what was drawn, and makes the display draw it again next time.
+		"""
+		self.image = None
+		display.overlayStates[self] = None
+		display.overlayBytes[self] = None
+
+
+def getLatest(times, values, frameTimes, maxAge=None):
+	"""
+	:return: Latest value at or before each frame time, NaN where there is none, or where it is older than maxAge
+	"""
+	latest = numpy.searchsorted(times, frameTimes, side='right') - 1
+	result = numpy.where(latest >= 0, values[numpy.maximum(latest, 0)], numpy.nan)
+	if maxAge is not None:
+		result[(latest >= 0) & (frameTimes - times[numpy.maximum(latest, 0)] > maxAge)] = numpy.nan
+	return result
+
+
+def getRollingMean(times, values, frameTimes, duration):
+	"""
+	:return: Mean of the values in the duration before each frame time. 0 if there are none in the window,
+	         like the live display, and NaN before the first value.
+	"""
+	sums = numpy.concatenate(([0.0], numpy.cumsum(values)))
+	last = numpy.searchsorted(times, frameTimes, side='right')
+	first = numpy.searchsorted(times, frameTimes - duration, side='right')
+	counts = last - first
+	means = numpy.where(counts > 0, (sums[last] - sums[first]) / numpy.maximum(counts, 1), 0.0)
+	means[last == 0] = numpy.nan
+	return means
+
+
+def loadSession(sessionDir):
+	"""
+	:return: Dictionary of the recorded streams, as loaded by analysis.loadStream, and the gear changes
+	"""
+	with open(os.path.join(sessionDir, recording.sessionFileName), encoding='utf-8') as file:
+		startTime = datetime.fromisoformat(json.load(file)['startTime'])
+	gearTimes, gears = analysis.loadGearChanges(sessionDir, startTime)
+	return {
+		'gps': analysis.loadStream(sessionDir, recording.gpsFileName, analysis.gpsColumns),
+		'heartRate': analysis.loadStream(sessionDir, recording.heartRateFileName, analysis.heartRateColumns),
+		'power': analysis.loadStream(sessionDir, recording.powerFileName, analysis.powerColumns),
+		'gear': {'sessionTime': gearTimes, 'gear': gears.astype(float)}
+	}
+
+
+def getFrameStates(session, frameTimes):
+	"""
+	Works out what the display shows at each frame time, from the recorded data.
+
+	:param session: Recorded data from loadSession
+	:return: (states, speeds). States is an array with a row of integers for each frame, describing what each overlay
+	         shows. Frames with the same state look the same. Speeds are the speeds in m/s, for drawing.
+	"""
+	gps = session['gps']
+	power = session['power']
+	heartRate = session['heartRate']
+
+	hasSpeed = ~numpy.isnan(gps['speed'])
+	speeds = getLatest(gps['sessionTime'][hasSpeed], gps['speed'][hasSpeed], frameTimes, maxGpsGap)
+	hasPower = ~numpy.isnan(power['instantaneousPower'])
+	powers = getRollingMean(power['sessionTime'][hasPower], power['instantaneousPower'][hasPower], frameTimes,
+	                        powerAverageTime)
+	hasHeartRate = ~numpy.isnan(heartRate['heartRate'])
+	heartRates = getLatest(heartRate['sessionTime'][hasHeartRate], heartRate['heartRate'][hasHeartRate], frameTimes)
+	frameGears = getLatest(session['gear']['sessionTime'], session['gear']['gear'], frameTimes)
+
+	def toState(values):
+		return numpy.where(numpy.isnan(values), missing, numpy.trunc(numpy.nan_to_num(values))).astype(numpy.int64)
+
+	# Speed is shown in whole km/h and mph, and unknown speed is shown as '--'
+	states = numpy.column_stack((toState(speeds * 3.6), toState(speeds * 2.237), toState(powers),
+	                             toState(heartRates), toState(frameGears)))
+	return states, speeds
+
+
+def getRuns(states):
+	"""
+	:return: Index of the first frame of each run of frames with the same state, and the length of each run
+	"""
+	if len(states) == 0:
+		return numpy.zeros(0, dtype=int), numpy.zeros(0, dtype=int)
+	isChanged = numpy.concatenate(([True], numpy.any(states[1:] != states[:-1], axis=1)))
+	starts = numpy.flatnonzero(isChanged)
+	lengths = numpy.diff(starts, append=len(states))
+	return starts, lengths
+
+
+def startRenderer():
+	"""
+	Sets up the display in a worker process.
+	"""
+	global renderCamera
+	renderCamera = CaptureCamera()
+	display.start(renderCamera)
+
+
+def renderFrame(speed, state):
+	"""
+	Draws the display for one frame state, in a worker process.
+
+	:return: RGBA image of the frame
+	"""
+	kmh, mph, power, heartRate, gear = state
+	if kmh == missing:
+		display.drawSpeedAndDistance(None, None)
+	else:
+		display.drawSpeedAndDistance(speed, None)
+	if power == missing:
+		display.powerBarOverlay.clear()
+	else:
+		display.drawPower(power, config.powerGoal)
+	if heartRate == missing:
+		display.heartRateOverlay.clear()
+	else:
+		display.drawHeartRate(heartRate)
+	if gear == missing:
+		display.gearOverlay.clear()
+	else:
+		display.drawGearNumber(gear)
+	return renderCamera.makeFrame()
+
+
+def renderPng(task):
+	"""
+	:param task: (speed, state, path to save the frame to)
+	"""
+	speed, state, path = task
+	renderFrame(speed, state).save(path, compress_level=1)
+
+
+def renderRaw(task):
+	speed, state = task
+	return renderFrame(speed, state).tobytes()
+
+
+def getFrameTimes(sessionDir, session, fps):
+	"""
+	:return: Session time of each recorded video frame, or times at a fixed rate if there is no video index
+	"""
+	try:
+		videoIndex = VideoIndex(sessionDir)
+	except OSError:
+		videoIndex = None
+	if videoIndex is not None and videoIndex.getFrameCount():
+		return numpy.concatenate([index['sessionTime'] for index in videoIndex.indexes])
+	endTime = max((stream['sessionTime'][-1] for stream in session.values() if len(stream['sessionTime'])), default=0)
+	return numpy.arange(0, endTime, 1 / fps)
+
+
+def render(sessionDir, pngDir=None, rawOutput=None, fps=49, processes=None):
+	"""
+	Renders a frame of the display for each video frame of a session.
+	Only frames where something on the display changes are drawn. The rest are copies of the frame before.
+
+	:param pngDir: Directory to save frame-NNNNNN.png files to. Unchanged frames are hard links to the frame before.
+	:param rawOutput: Binary file to write RGBA frames to, e.g. sys.stdout.buffer
+	:param fps: Frame rate if there is no video index
+	:param processes: Number of worker processes. Default is one for each CPU.
+	:return: (number of frames, number of frames drawn)
+	"""
+	session = loadSession(sessionDir)
+	frameTimes = getFrameTimes(sessionDir, session, fps)
+	states, speeds = getFrameStates(session, frameTimes)
+	starts, lengths = getRuns(states)
+
+	with Pool(processes, initializer=startRenderer) as pool:
+		if pngDir is not None:
+			os.makedirs(pngDir, exist_ok=True)
+			paths = [os.path.join(pngDir, f'frame-{i:06d}.png') for i in range(len(frameTimes))]
+			tasks = ((speeds[start], states[start].tolist(), paths[start]) for start in starts)
+			for start, length, result in zip(starts, lengths, pool.imap(renderPng, tasks, chunksize=8)):
+				for i in range(start + 1, start + length):
+					linkFrame(paths[start], paths[i])
+		else:
+			tasks = ((speeds[start], states[start].tolist()) for start in starts)
+			for length, frameBytes in zip(lengths, pool.imap(renderRaw, tasks, chunksize=2)):
+				for i in range(length):
+					rawOutput.write(frameBytes)
+	return len(frameTimes), len(starts)
+
+
+def linkFrame(source, destination):
+	if os.path.exists(destination):
+		os.remove(destination)
+	try:
+		os.link(source, destination)
+	except OSError:
+		shutil.copyfile(source, destination)
+
+
+
+if __name__ == '__main__':
+	import argparse
+	argParser = argparse.ArgumentParser(description='Render the display for a recorded session.')
+	argParser.add_argument('session', help='session directory, e.g. data/001')
+	outputGroup = argParser.add_mutually_exclusive_group(required=True)
+	outputGroup.add_argument('--png', metavar='DIR', help='save a PNG file for each frame to a directory')
+	outputGroup.add_argument('--raw', action='store_true', help='write RGBA frames to standard output')
+	argParser.add_argument('--fps', type=float, default=49, help='frame rate if the session has no video index')
+	argParser.add_argument('--processes', type=int, help='number of processes to render with')
+	args = argParser.parse_args()
+
+	startTime = time.monotonic()
+	frameCount, drawnCount = render(args.session, args.png, sys.stdout.buffer if args.raw else None, args.fps,
+	                                args.processes)
+	print(f'Rendered {frameCount} frames ({drawnCount} drawn) in {time.monotonic() - startTime:.2f} s', file=sys.stderr)
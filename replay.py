@@ -0,0 +1,265 @@
+"""
+
+  Replays a recorded session through the same functions that handle live sensor data,
+  without any of the hardware. Used for testing and profiling the display and recording code.
+
+  Usage: python3 replay.py <session directory> [--speed N]
+
+"""
+
+import csv
+import heapq
+import math
+import os
+import sys
+import time
+import types
+from datetime import datetime, timezone
+
+
+class ReplayGpsInfo:
+	"""
+	Stand-in for the response from gpsd.get_current(), filled in from a row of gps.csv.
+	"""
+	def __init__(self, row):
+		self.mode = 3
+		self.sats_valid = 1
+		self.time = row[1]
+		self.lat = toNumber(row[2])
+		self.lon = toNumber(row[3])
+		self.error = {'y': toNumber(row[4]), 'x': toNumber(row[5]), 's': toNumber(row[7])}
+		self.hspeed = toNumber(row[6])
+
+	def get_time(self, local_time=False):
+		return datetime.fromisoformat(self.time) if self.time else datetime.now(timezone.utc)
+
+
+class ReplayGpio:
+	"""
+	Stand-in for RPi.GPIO. The shut-down button is never pressed.
+	"""
+	BCM = 11
+	IN = 1
+	LOW = 0
+	HIGH = 1
+
+	def setmode(self, mode):
+		pass
+
+	def setup(self, pin, direction):
+		pass
+
+	def input(self, pin):
+		return self.HIGH
+
+	def cleanup(self, pin=None):
+		pass
+
+
+class ReplayGpsd:
+	"""
+	Stand-in for the gpsd module. get_current() returns the GPS row currently being replayed.
+	"""
+	def __init__(self):
+		self.current = None
+
+	def connect(self):
+		pass
+
+	def get_current(self):
+		if self.current is None:
+			raise Exception('No GPS data yet')
+		return self.current
+
+
+gpio = ReplayGpio()
+gpsd = ReplayGpsd()
+
+
+def installStandIns():
+	"""
+	Puts stand-ins for the hardware modules in place, so that main can be imported without them.
+	ANT and serial modules are only replaced if they are not installed, as they work without hardware.
+	"""
+	def makeModule(name, **attributes):
+		module = types.ModuleType(name)
+		module.__dict__.update(attributes)
+		sys.modules[name] = module
+		return module
+
+	class PiCameraError(Exception):
+		pass
+
+	gpioModule = makeModule('RPi.GPIO', **{name: getattr(gpio, name) for name in dir(gpio) if not name.startswith('_')})
+	makeModule('RPi', GPIO=gpioModule)
+	makeModule('picamera', exc=types.SimpleNamespace(PiCameraError=PiCameraError, PiCameraMMALError=PiCameraError))
+	sys.modules['gpsd'] = gpsd
+
+	try:
+		import ant.core.node
+		import ant.plus.power
+	except ImportError:
+		class ANTException(Exception):
+			pass
+		for name in ('ant', 'ant.core', 'ant.core.driver', 'ant.core.constants', 'ant.plus',
+		             'ant.plus.heartrate', 'ant.plus.power'):
+			makeModule(name)
+		makeModule('ant.core.node', Node=None, Network=None, ChannelID=None)
+		makeModule('ant.core.exceptions', ANTException=ANTException)
+
+	try:
+		import serial
+	except ImportError:
+		makeModule('serial', Serial=None)
+
+
+def toNumber(text):
+	"""
+	Converts a value from a CSV file to a number, or None if it is empty.
+	"""
+	if text in ('', 'None'):
+		return None
+	value = float(text)
+	return int(value) if value.is_integer() and '.' not in text else value
+
+
+def readRows(sessionDir, fileName, headerLines, makeEvent):
+	"""
+	Reads the CSV or binary file of a recorded stream.
+
+	:param sessionDir: Directory that the session was recorded to, ending with a slash
+	:param fileName: Name of the CSV file, e.g. recording.powerFileName
+	:param headerLines: Number of lines before the data starts in the CSV file
+	:param makeEvent: Function that converts a row to a (name, function, arguments) tuple
+	:return: Generator of (session time, name, function, arguments) tuples
+	"""
+	import recording
+
+	binaryPath = sessionDir + os.path.splitext(fileName)[0] + recording.binaryFileExtension
+	if os.path.exists(binaryPath):
+		return readBinaryRows(recording.readBinaryFile(binaryPath), makeEvent)
+	path = sessionDir + fileName
+	if not os.path.exists(path):
+		return iter(())
+	with open(path, encoding='utf-8') as file:
+		header = file.readline()
+	if header and not header.startswith('Session Time'):
+		raise ValueError(f'{path} was recorded before session times were added. '
+		                 f'Its streams have no common clock, so it can\'t be replayed.')
+	return readCsvRows(path, headerLines, makeEvent)
+
+
+def readCsvRows(path, headerLines, makeEvent):
+	with open(path, newline='', encoding='utf-8') as file:
+		reader = csv.reader(file)
+		for i in range(headerLines):
+			next(reader, None)
+		for row in reader:
+			if row:
+				yield (float(row[0]),) + makeEvent(row)
+
+
+def readBinaryRows(records, makeEvent):
+	"""
+	Converts binary records to rows like the CSV file has, so that the same functions can replay them.
+	"""
+	isTime = [name == 'time' for name in records.dtype.names]  # UTC time of GPS fixes, as a timestamp
+	for record in records:
+		row = []
+		for value, isTimeField in zip(record.tolist(), isTime):
+			if isinstance(value, float) and math.isnan(value):
+				row.append('')
+			elif isTimeField:
+				row.append(str(datetime.fromtimestamp(value, timezone.utc)))
+			else:
+				row.append(str(value))
+		yield (record[0],) + makeEvent(row)
+
+
+def replay(sessionDir, speed=1.0, drawAll=False, outputDir='./replay-data/'):
+	"""
+	Replays a recorded session.
+
+	:param sessionDir: Directory that the session was recorded to
+	:param speed: How many times faster than real time to replay. 0 to replay as fast as possible.
+	:param drawAll: Also draw heart rate and power, even if main doesn't draw them yet.
+	:param outputDir: Base directory to record the replayed session to
+	:return: Dictionary of the number of rows replayed for each stream
+	"""
+	installStandIns()
+	import config
+	import display
+	import recording
+	import main
+
+	def onHeartRate(row):
+		main.heartRateData(toNumber(row[2]), toNumber(row[1]), None)
+		if drawAll:
+			display.drawHeartRate(main.heartRate)
+
+	def onPower(row):
+		main.powerData(toNumber(row[1]), toNumber(row[4]), toNumber(row[5]), toNumber(row[3]), toNumber(row[2]))
+		if drawAll:
+			display.drawPower(main.powerStats.getMean(3) or 0, config.powerGoal)
+
+	def onTorque(row):
+		main.torqueAndPedalData(*[toNumber(value) for value in row[1:6]])
+
+	def onGps(row):
+		gpsd.current = ReplayGpsInfo(row)
+		main.isGpsActive = True
+		main.updateGps()
+
+	sessionDir = os.path.join(sessionDir, '')
+	streams = [
+		readRows(sessionDir, recording.heartRateFileName, 1, lambda row: ('heart rate', onHeartRate, row)),
+		readRows(sessionDir, recording.powerFileName, 1, lambda row: ('power', onPower, row)),
+		readRows(sessionDir, recording.torqueFileName, 2, lambda row: ('torque', onTorque, row)),
+		readRows(sessionDir, recording.gpsFileName, 1, lambda row: ('GPS', onGps, row)),
+	]
+
+	recording.baseDir = outputDir
+	recording.openFiles()
+	main.camera = main.DummyCamera()
+	display.start(main.camera)
+	main.showMessage(f'Replaying {sessionDir}')
+
+	counts = {}
+	startTime = time.monotonic()
+	for sessionTime, name, function, row in heapq.merge(*streams, key=lambda event: event[0]):
+		if speed > 0:
+			waitTime = startTime + sessionTime / speed - time.monotonic()
+			if waitTime > 0:
+				time.sleep(waitTime)
+		function(row)
+		counts[name] = counts.get(name, 0) + 1
+	elapsed = time.monotonic() - startTime
+
+	recording.log(f'Replayed {counts} in {elapsed:.2f} s')
+	display.stop()
+	recording.closeFiles()
+
+	print(f'Replayed {sum(counts.values())} rows in {elapsed:.2f} s: {counts}')
+	print(f'Overlay updates: {display.overlayUpdatesPushed} pushed, {display.overlayUpdatesSkipped} skipped')
+	print(f'Text cache: {display.textCacheHits} hits, {display.textCacheMisses} misses')
+	print(f'Status overlays: {display.statusSlotFallbacks} added because no pre-made one was free')
+	print(f'Power: {main.powerStats.getSummary()}')
+	print(f'Heart rate: {main.heartRateStats.getSummary()}')
+	print(f'ANT events: {main.heartRateEvents}, {main.powerEvents}, {main.torqueEvents}')
+	print(f'Recording: {recording.droppedRowCount} rows dropped, max write time {recording.maxWriteLatency * 1000:.1f} ms')
+	return counts
+
+
+
+if __name__ == '__main__':
+	import argparse
+	argParser = argparse.ArgumentParser(description='Replay a recorded session without any hardware.')
+	argParser.add_argument('session', help='session directory, e.g. data/001')
+	argParser.add_argument('--speed', type=float, default=1.0, help='times faster than real time, 0 for as fast as possible')
+	argParser.add_argument('--draw-all', action='store_true', help='also draw heart rate and power')
+	argParser.add_argument('--output', default='./replay-data/', help='base directory to record the replay to')
+	args = argParser.parse_args()
+	try:
+		replay(args.session, args.speed, args.draw_all, args.output)
+	except ValueError as error:
+		sys.exit(str(error))
@@ -0,0 +1,201 @@
+"""
+
+  Scheduling of functions to be called at a later time
+
+"""
+
+import heapq
+import itertools
+import time
+import traceback
+from threading import Thread, Condition
+
+
+class ExpiryScheduler:
+	"""
+	Calls functions after a timeout, using a single background thread for all of them.
+	Each scheduled call has a key, which can be used to cancel it or to schedule it again with a new timeout.
+	"""
+	def __init__(self, name='Expiry scheduler'):
+		self.name = name
+		self.heap = []         # Entries ordered by deadline. Cancelled entries are left in until they come up.
+		self.entries = {}      # Active entry for each key
+		self.sequence = itertools.count()  # Keeps entries with equal deadlines in the order they were added
+		self.condition = Condition()
+		self.thread = None
+		self.isRunning = False
+
+	def start(self):
+		with self.condition:
+			if self.isRunning:
+				return
+			self.isRunning = True
+		self.thread = Thread(target=self.run, name=self.name, daemon=True)
+		self.thread.start()
+
+	def stop(self):
+		with self.condition:
+			self.isRunning = False
+			self.condition.notify()
+		if self.thread is not None:
+			self.thread.join()
+			self.thread = None
+
+	def schedule(self, key, timeout, function, *args):
+		"""
+		Schedules a function to be called after a timeout.
+		If something is already scheduled with the same key, it is replaced.
+
+		:param key: Used to refer to this call later
+		:param timeout: Number of seconds from now to call the function
+		:param function: Function to call
+		:param args: Arguments to pass to the function
+		"""
+		entry = [time.monotonic() + timeout, next(self.sequence), key, function, args, True]
+		with self.condition:
+			oldEntry = self.entries.get(key)
+			if oldEntry is not None:
+				oldEntry[5] = False
+			self.entries[key] = entry
+			heapq.heappush(self.heap, entry)
+			if self.heap[0] is entry:
+				self.condition.notify()  # Deadline is earlier than the one being waited on
+
+	def cancel(self, key):
+		"""
+		Cancels a scheduled call. Does nothing if there is no such call.
+
+		:param key: Key the call was scheduled with
+		:return: True if a call was cancelled
+		"""
+		with self.condition:
+			entry = self.entries.pop(key, None)
+			if entry is None:
+				return False
+			entry[5] = False
+			return True
+
+	def pendingCount(self):
+		"""
+		:return: Number of calls that are scheduled but have not happened yet
+		"""
+		with self.condition:
+			return len(self.entries)
+
+	def run(self):
+		while True:
+			with self.condition:
+				entry = None
+				while entry is None:
+					if not self.isRunning:
+						return
+					# Throw away any cancelled entries at the front
+					while self.heap and not self.heap[0][5]:
+						heapq.heappop(self.heap)
+					if not self.heap:
+						self.condition.wait()
+						continue
+					waitTime = self.heap[0][0] - time.monotonic()
+					if waitTime > 0:
+						self.condition.wait(waitTime)
+						continue
+					entry = heapq.heappop(self.heap)
+					entry[5] = False
+					del self.entries[entry[2]]
+
+			# Call outside the lock so the function can schedule or cancel other calls
+			deadline, sequence, key, function, args, isActive = entry
+			try:
+				function(*args)
+			except Exception:
+				traceback.print_exc()  # Same as what an uncaught exception in a Timer thread would do
+
+
+class PeriodicTask:
+	"""
+	A function that is called repeatedly by a PeriodicScheduler, along with timing statistics.
+	"""
+	def __init__(self, name, interval, function, nextRunTime):
+		self.name = name
+		self.interval = interval
+		self.baseInterval = interval  # Interval it was added with, for when interval is changed temporarily
+		self.function = function
+		self.nextRunTime = nextRunTime
+		self.runCount = 0
+		self.totalRunTime = 0.0
+		self.maxRunTime = 0.0
+		self.totalLateness = 0.0   # How long after it was due that it actually ran
+		self.maxLateness = 0.0
+
+	def getStats(self):
+		"""
+		:return: Summary of how long the task takes to run and how late it is, as a string
+		"""
+		meanRunTime = self.totalRunTime / self.runCount if self.runCount else 0
+		meanLateness = self.totalLateness / self.runCount if self.runCount else 0
+		return (f'{self.name}: {self.runCount} runs, '
+		        f'run time mean {meanRunTime*1000:.1f} ms max {self.maxRunTime*1000:.1f} ms, '
+		        f'lateness mean {meanLateness*1000:.1f} ms max {self.maxLateness*1000:.1f} ms')
+
+
+class PeriodicScheduler:
+	"""
+	Runs functions at regular intervals, each with its own interval.
+	Runs on the thread that calls runNext, sleeping until the next function is due.
+	"""
+	def __init__(self):
+		self.tasks = []
+		self.heap = []
+		self.sequence = itertools.count()
+
+	def addTask(self, name, interval, function, delay=0):
+		"""
+		Adds a function to be called repeatedly.
+
+		:param name: Name of the task, for statistics
+		:param interval: Number of seconds between each call
+		:param function: Function to call, with no arguments
+		:param delay: Number of seconds to wait before the first call
+		:return: The PeriodicTask object
+		"""
+		task = PeriodicTask(name, interval, function, time.monotonic() + delay)
+		self.tasks.append(task)
+		heapq.heappush(self.heap, (task.nextRunTime, next(self.sequence), task))
+		return task
+
+	def runNext(self):
+		"""
+		Waits until the next task is due then runs it.
+		Any exception from the task is passed on, and the task will still be run again next interval.
+		"""
+		nextRunTime, sequence, task = heapq.heappop(self.heap)
+		waitTime = nextRunTime - time.monotonic()
+		if waitTime > 0:
+			try:
+				time.sleep(waitTime)
+			except BaseException:
+				heapq.heappush(self.heap, (nextRunTime, sequence, task))
+				raise
+
+		startTime = time.monotonic()
+		try:
+			task.function()
+		finally:
+			endTime = time.monotonic()
+			runTime = endTime - startTime
+			lateness = startTime - nextRunTime
+			task.runCount += 1
+			task.totalRunTime += runTime
+			task.maxRunTime = max(task.maxRunTime, runTime)
+			task.totalLateness += lateness
+			task.maxLateness = max(task.maxLateness, lateness)
+
+			# If it has fallen more than an interval behind, skip the missed runs rather than trying to catch up
+			task.nextRunTime = max(nextRunTime + task.interval, endTime)
+			heapq.heappush(self.heap, (task.nextRunTime, next(self.sequence), task))
+
+	def getStats(self):
+		"""
+		:return: List of statistics strings, one for each task
+		"""
+		return [task.getStats() for task in self.tasks]
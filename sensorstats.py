@@ -0,0 +1,265 @@
+"""
+
+  Rolling statistics of sensor readings, e.g. 3 s average power and normalised power
+
+  Everything here has a fixed amount of memory that is set up front, so adding a sample
+  is quick enough to do in the ANT callbacks.
+
+"""
+
+import math
+from array import array
+
+
+class RollingWindow:
+	"""
+	Mean and max of the samples from the last few seconds.
+	Samples are kept in a ring buffer. The max is found with a second ring buffer of the samples that
+	could still become the max, in decreasing order, so both are O(1) per sample on average.
+	"""
+	def __init__(self, duration, maxRate=8):
+		"""
+		:param duration: Seconds of samples to keep
+		:param maxRate: Most samples per second expected. If more arrive, the oldest are dropped early.
+		"""
+		self.duration = duration
+		self.capacity = max(int(math.ceil(duration * maxRate)), 1)
+		self.times = array('d', bytes(8 * self.capacity))
+		self.values = array('d', bytes(8 * self.capacity))
+		self.first = 0     # Index of the oldest sample
+		self.count = 0
+		self.total = 0.0
+		# Indexes into times/values of samples that could be the max, largest first
+		self.maxIndexes = array('l', bytes(array('l').itemsize * self.capacity))
+		self.maxFirst = 0
+		self.maxCount = 0
+
+	def add(self, time, value):
+		"""
+		:param time: Time of the sample in seconds, e.g. session time
+		:param value: Reading from the sensor
+		"""
+		self.removeOlderThan(time - self.duration)
+		if self.count == self.capacity:
+			self.removeOldest()
+
+		index = (self.first + self.count) % self.capacity
+		self.times[index] = time
+		self.values[index] = value
+		self.count += 1
+		self.total += value
+
+		# Samples smaller than this one can never be the max again
+		while self.maxCount and self.values[self.maxIndexes[(self.maxFirst + self.maxCount - 1) % self.capacity]] <= value:
+			self.maxCount -= 1
+		self.maxIndexes[(self.maxFirst + self.maxCount) % self.capacity] = index
+		self.maxCount += 1
+
+	def removeOlderThan(self, time):
+		while self.count and self.times[self.first] < time:
+			self.removeOldest()
+
+	def removeOldest(self):
+		if self.maxCount and self.maxIndexes[self.maxFirst] == self.first:
+			self.maxFirst = (self.maxFirst + 1) % self.capacity
+			self.maxCount -= 1
+		self.total -= self.values[self.first]
+		self.first = (self.first + 1) % self.capacity
+		self.count -= 1
+		if self.count == 0:
+			self.total = 0.0  # Don't let rounding errors build up
+
+	def getMean(self):
+		"""
+		:return: Mean of the samples in the window, or None if there are none
+		"""
+		return self.total / self.count if self.count else None
+
+	def getMax(self):
+		"""
+		:return: Largest sample in the window, or None if there are none
+		"""
+		return self.values[self.maxIndexes[self.maxFirst]] if self.maxCount else None
+
+	def clear(self):
+		self.first = self.count = self.maxFirst = self.maxCount = 0
+		self.total = 0.0
+
+
+class ExponentialAverage:
+	"""
+	Exponentially weighted average that allows for samples arriving at uneven times.
+	"""
+	def __init__(self, timeConstant):
+		"""
+		:param timeConstant: Seconds for the weight of a sample to drop to 1/e
+		"""
+		self.timeConstant = timeConstant
+		self.value = None
+		self.lastTime = 0.0
+
+	def add(self, time, value):
+		if self.value is None:
+			self.value = float(value)
+		else:
+			weight = 1.0 - math.exp(-max(time - self.lastTime, 0.0) / self.timeConstant)
+			self.value += weight * (value - self.value)
+		self.lastTime = time
+
+	def clear(self):
+		self.value = None
+
+
+class ResampledAverage:
+	"""
+	Rolling mean of a stream resampled to one value per second, taking the latest sample at or before each second.
+	Normalised power is worked out from this, so that it doesn't depend on how often samples arrive.
+	Matches analysis.getNormalisedPower.
+	"""
+	def __init__(self, count=30, step=1.0):
+		"""
+		:param count: Number of resampled values to average over
+		:param step: Seconds between resampled values
+		"""
+		self.count = count
+		self.step = step
+		self.values = array('d', bytes(8 * count))
+		self.next = 0          # Index to put the next resampled value at
+		self.filled = 0
+		self.total = 0.0
+		self.nextTime = None   # Time of the next resampled value
+		self.latest = 0.0
+
+	def add(self, time, value, accumulators):
+		"""
+		Resamples up to the time of a new sample, and passes the rolling mean at each resampled time to the
+		accumulators once there are enough values to average.
+		"""
+		if self.nextTime is None:
+			self.nextTime = time
+		# Resampled times before this sample take the sample before it
+		while self.nextTime < time:
+			self.total += self.latest - self.values[self.next]
+			self.values[self.next] = self.latest
+			self.next = (self.next + 1) % self.count
+			if self.filled < self.count:
+				self.filled += 1
+			if self.filled == self.count:
+				mean = self.total / self.count
+				for accumulator in accumulators:
+					accumulator.addSmoothed(mean)
+			self.nextTime += self.step
+		self.latest = value
+
+
+class Accumulator:
+	"""
+	Totals for a lap or segment, or for the whole ride.
+	"""
+	def __init__(self, startTime=0.0):
+		self.reset(startTime)
+
+	def reset(self, startTime):
+		"""
+		Starts accumulating again from zero, e.g. at the start of a new lap.
+		"""
+		self.startTime = startTime
+		self.lastTime = startTime
+		self.count = 0
+		self.total = 0.0
+		self.max = None
+		self.totalFourthPower = 0.0  # For normalised power
+		self.fourthPowerCount = 0
+
+	def add(self, time, value):
+		self.lastTime = time
+		self.count += 1
+		self.total += value
+		if self.max is None or value > self.max:
+			self.max = value
+
+	def addSmoothed(self, value):
+		"""
+		:param value: Mean of the last 30 s, for normalised power
+		"""
+		self.totalFourthPower += value ** 4
+		self.fourthPowerCount += 1
+
+	def getMean(self):
+		return self.total / self.count if self.count else None
+
+	def getNormalised(self):
+		"""
+		:return: Fourth root of the mean of the fourth powers of the 30 s averages, or None if there are none
+		"""
+		return (self.totalFourthPower / self.fourthPowerCount) ** 0.25 if self.fourthPowerCount else None
+
+	def getDuration(self):
+		return self.lastTime - self.startTime
+
+
+class SensorStats:
+	"""
+	All the statistics kept for one stream of sensor readings.
+	"""
+	def __init__(self, name, windowDurations=(3, 10, 30), timeConstant=5.0, maxRate=8):
+		"""
+		:param name: Name of the stream, e.g. 'Power'
+		:param windowDurations: Seconds for each rolling window
+		:param timeConstant: Seconds for the exponentially weighted average
+		:param maxRate: Most samples per second expected
+		"""
+		self.name = name
+		self.windows = {duration: RollingWindow(duration, maxRate) for duration in windowDurations}
+		self.smoothedAverage = ResampledAverage(30)
+		self.exponentialAverage = ExponentialAverage(timeConstant)
+		self.lap = Accumulator()
+		self.ride = Accumulator()
+		self.latest = None
+		self.latestTime = 0.0
+
+	def add(self, time, value):
+		"""
+		Adds a sample to all the statistics. Samples must be added in time order.
+
+		:param time: Time of the sample in seconds, e.g. session time
+		:param value: Reading from the sensor. None is ignored.
+		"""
+		if value is None:
+			return
+		self.latest = value
+		self.latestTime = time
+		for window in self.windows.values():
+			window.add(time, value)
+		self.exponentialAverage.add(time, value)
+		self.lap.add(time, value)
+		self.ride.add(time, value)
+		self.smoothedAverage.add(time, value, (self.lap, self.ride))
+
+	def getMean(self, duration):
+		"""
+		:param duration: One of the window durations given to the constructor
+		:return: Mean over the last duration seconds, or None if there are no samples
+		"""
+		return self.windows[duration].getMean()
+
+	def getMax(self, duration):
+		return self.windows[duration].getMax()
+
+	def getExponentialAverage(self):
+		return self.exponentialAverage.value
+
+	def startLap(self, time):
+		self.lap.reset(time)
+
+	def getSummary(self):
+		"""
+		:return: Dictionary of the ride totals, for logging
+		"""
+		return {
+			'name': self.name,
+			'samples': self.ride.count,
+			'mean': self.ride.getMean(),
+			'max': self.ride.max,
+			'normalised': self.ride.getNormalised()
+		}
@@ -0,0 +1,209 @@
+"""
+
+  Pretends to be the gear shifter Arduino, for testing the gear shifter communication without the hardware.
+  Run this file to benchmark how quickly gear changes get from the serial port to the display.
+
+"""
+
+import os
+import pty
+import random
+import time
+import tty
+from threading import Thread, Lock, Condition
+
+from gearshifter import GearShifter, SHUTDOWN_MSG, ACKNOWLEDGE_MSG, DEBUG_MSG, GEAR_CHANGING_MSG, GEAR_CHANGED_MSG
+
+
+class FakeGearShifter:
+	"""
+	Acts like gear_shifter.ino on the other end of a pseudo-terminal.
+	Pass the `port` attribute to GearShifter in place of the real serial port.
+	"""
+	def __init__(self, gear=1, maxGears=11, baudRate=9600):
+		"""
+		:param gear: Gear to start in
+		:param maxGears: Number of gears
+		:param baudRate: Data is sent no faster than a real serial port at this speed would. None for no limit.
+		"""
+		self.gear = gear
+		self.maxGears = maxGears
+		self.baudRate = baudRate
+		self.masterFd, self.slaveFd = pty.openpty()
+		tty.setraw(self.slaveFd)
+		self.port = os.ttyname(self.slaveFd)
+		self.isStarted = False    # Startup message has been received
+		self.isShutDown = False   # Shutdown message has been received
+		self.received = []        # Messages received from the Pi
+		self.writeLock = Lock()
+		self.condition = Condition()
+		self.isRunning = True
+		self.thread = Thread(target=self.run, name='Fake gear shifter', daemon=True)
+		self.thread.start()
+
+	def close(self):
+		self.isRunning = False
+		os.close(self.slaveFd)  # Makes the read in the thread fail
+		self.thread.join()
+		os.close(self.masterFd)
+
+	def waitForStartup(self, timeout=5.0):
+		"""
+		:return: True if the startup message was received in time
+		"""
+		with self.condition:
+			return self.condition.wait_for(lambda: self.isStarted, timeout)
+
+	def sendMessage(self, commsType, value):
+		"""
+		Sends a message to the Pi, the same way sendMessage in gear_shifter.ino does.
+		"""
+		data = f'{commsType}{value}\n'.encode('utf-8')
+		with self.writeLock:
+			os.write(self.masterFd, data)
+			if self.baudRate:
+				time.sleep(len(data) * 10 / self.baudRate)  # 8 data bits plus start and stop bits
+
+	def changeGear(self, gear):
+		"""
+		Sends the messages for a gear change, like pressing a button on the real gear shifter.
+		"""
+		self.gear = max(1, min(gear, self.maxGears))
+		self.sendMessage(GEAR_CHANGING_MSG, self.gear)
+		self.sendMessage(GEAR_CHANGED_MSG, self.gear)
+
+	def playScript(self, script):
+		"""
+		Sends a list of messages with delays between them.
+
+		:param script: List of (delay, type, value) tuples. Delay is seconds to wait before sending.
+		"""
+		for delay, commsType, value in script:
+			if delay > 0:
+				time.sleep(delay)
+			self.sendMessage(commsType, value)
+
+	def playRandomBursts(self, burstCount, maxBurstLength=5, maxGap=0.5, seed=None):
+		"""
+		Sends bursts of gear changes in random directions, with random gaps between them.
+		"""
+		rng = random.Random(seed)
+		for i in range(burstCount):
+			direction = rng.choice((-1, 1))
+			for j in range(rng.randint(1, maxBurstLength)):
+				self.changeGear(self.gear + direction)
+			time.sleep(rng.uniform(0, maxGap))
+
+	def run(self):
+		while self.isRunning:
+			try:
+				data = os.read(self.masterFd, 64)
+			except OSError:
+				break
+			for byte in data.decode('utf-8', errors='replace'):
+				self.received.append(byte)
+				if not self.isStarted:
+					with self.condition:
+						self.isStarted = True
+						self.condition.notify_all()
+					if byte == DEBUG_MSG:
+						self.sendMessage(DEBUG_MSG, 'Debug mode. Adjust servos with up/down buttons')
+					else:
+						self.sendMessage(GEAR_CHANGED_MSG, self.gear)
+				elif byte == SHUTDOWN_MSG and not self.isShutDown:
+					self.isShutDown = True
+					self.sendMessage(ACKNOWLEDGE_MSG, 'Shutting down.')
+
+
+
+### Benchmark ###
+
+def runBenchmark(count=200, burstLength=20, baudRate=9600, draw=True):
+	"""
+	Measures the time from a gear message being sent to the gear being drawn,
+	and how many messages per second can be handled.
+
+	:param count: Number of single gear changes to time
+	:param burstLength: Number of gear changes in each burst when measuring throughput
+	:param baudRate: Speed to send at, or None for as fast as possible
+	:param draw: If True, draw the gear number with display.drawGearNumber, otherwise only time the parsing
+	"""
+	drawn = []   # (time, gear, isChanging) for each draw
+	drawnCondition = Condition()
+
+	if draw:
+		import display
+		from nullcamera import NullCamera
+		display.start(NullCamera())
+		drawGearNumber = display.drawGearNumber
+	else:
+		drawGearNumber = lambda gear, isChanging=False: None
+
+	def onMessage(commsType, value):
+		if commsType in (GEAR_CHANGING_MSG, GEAR_CHANGED_MSG):
+			drawGearNumber(value, isChanging=(commsType == GEAR_CHANGING_MSG))
+			with drawnCondition:
+				drawn.append((time.perf_counter(), value, commsType == GEAR_CHANGING_MSG))
+				drawnCondition.notify_all()
+
+	def waitForDraw(gear, timeout=2.0):
+		with drawnCondition:
+			return drawnCondition.wait_for(lambda: drawn and drawn[-1][1:] == (gear, False), timeout)
+
+	fake = FakeGearShifter(baudRate=baudRate, maxGears=1000000)
+	gearShifter = GearShifter(fake.port, onMessage, lambda message, error: print(message, error))
+	gearShifter.start()
+	if not fake.waitForStartup():
+		raise Exception('Gear shifter did not start up')
+	waitForDraw(fake.gear)
+
+	# Latency of single gear changes
+	latencies = []
+	for i in range(count):
+		gear = fake.gear + 1
+		message = f'{GEAR_CHANGED_MSG}{gear}\n'.encode('utf-8')
+		sendTime = time.perf_counter()
+		os.write(fake.masterFd, message)
+		fake.gear = gear
+		if waitForDraw(gear):
+			latencies.append(drawn[-1][0] - sendTime)
+
+	# Throughput of bursts of gear changes
+	parser = gearShifter.parser
+	startCount = parser.messageCount
+	startDraws = len(drawn)
+	startTime = time.perf_counter()
+	for i in range(count // burstLength + 1):
+		for j in range(burstLength):
+			fake.changeGear(fake.gear + 1)
+		waitForDraw(fake.gear)
+	elapsed = time.perf_counter() - startTime
+	messageCount = parser.messageCount - startCount
+	drawCount = len(drawn) - startDraws
+
+	gearShifter.stop()
+	fake.close()
+	if draw:
+		display.stop()
+
+	latencies.sort()
+	print(f'Latency over {len(latencies)} gear changes ({count - len(latencies)} timed out):')
+	if latencies:
+		print(f'  mean {sum(latencies) / len(latencies) * 1000:.2f} ms, '
+		      f'median {latencies[len(latencies) // 2] * 1000:.2f} ms, '
+		      f'p99 {latencies[int(len(latencies) * 0.99)] * 1000:.2f} ms, '
+		      f'max {latencies[-1] * 1000:.2f} ms')
+	print(f'Throughput: {messageCount / elapsed:.0f} messages/s, {drawCount} draws for {messageCount} messages '
+	      f'({parser.coalescedCount} skipped as out of date, {parser.malformedCount} malformed)')
+
+
+
+if __name__ == '__main__':
+	import argparse
+	argParser = argparse.ArgumentParser(description='Benchmark gear shifter communication using a fake gear shifter.')
+	argParser.add_argument('--count', type=int, default=200, help='number of gear changes to time')
+	argParser.add_argument('--burst', type=int, default=20, help='number of gear changes in each burst')
+	argParser.add_argument('--baud', type=int, default=9600, help='serial speed to simulate, 0 for no limit')
+	argParser.add_argument('--no-draw', action='store_true', help='do not draw the gear number')
+	args = argParser.parse_args()
+	runBenchmark(args.count, args.burst, args.baud or None, not args.no_draw)
@@ -28,12 +28,35 @@ class MockCamera:
 class MockOverlay:
 	def __init__(self, tkWindow, imageBytes, pos):
 		self.tkWindow = tkWindow
-		self.window = pos
+		self._window = pos
+		self._alpha = 255
 		self.image = None
 		self.imageWidget = tk.Label(tkWindow, background='grey')
 		self.imageWidget.place(x=pos[0], y=pos[1], width=pos[2], height=pos[3])
 		self.update(imageBytes)
 
+	@property
+	def window(self):
+		return self._window
+
+	@window.setter
+	def window(self, pos):
+		self._window = pos
+		if self._alpha > 0:
+			self.imageWidget.place(x=pos[0], y=pos[1], width=pos[2], height=pos[3])
+
+	@property
+	def alpha(self):
+		return self._alpha
+
+	@alpha.setter
+	def alpha(self, value):
+		self._alpha = value
+		if value > 0:
+			self.window = self._window
+		else:
+			self.imageWidget.place_forget()
+
 	def update(self, imageBytes):
 		self.image = ImageTk.PhotoImage(Image.frombytes('RGBA', self.window[2:4], imageBytes))
 		self.imageWidget['image'] = self.image
@@ -0,0 +1,106 @@
+"""
+
+  Finds the video frame recorded at a given session time, using the frame index recorded with each video file.
+  Needs NumPy, which is not required for recording.
+
+  Usage: python3 videoindex.py <session directory> <session time> ...
+
+"""
+
+import json
+import os
+from collections import namedtuple
+
+import numpy
+
+import recording
+
+
+VideoFrame = namedtuple('VideoFrame', ['fileName', 'frame', 'sessionTime', 'position', 'keyFramePosition'])
+VideoFrame.__doc__ = """
+A frame in a recorded video file.
+Position is the byte offset of the frame in the file. To decode it, start from the key frame position.
+"""
+
+
+class VideoIndex:
+	"""
+	The frame indexes of all the video files recorded in a session.
+	"""
+	def __init__(self, sessionDir):
+		"""
+		:param sessionDir: Directory that the session was recorded to
+		"""
+		with open(os.path.join(sessionDir, recording.sessionFileName), encoding='utf-8') as file:
+			videoFiles = json.load(file).get('videoFiles', [])
+
+		self.fileNames = []
+		self.indexes = []
+		self.keyFrames = []     # Indexes into each index of its key frames
+		self.startTimes = []    # Session time of the first frame in each file
+		for videoFile in videoFiles:
+			if 'index' not in videoFile or videoFile.get('deleted'):
+				continue
+			index = recording.readBinaryFile(os.path.join(sessionDir, videoFile['index']))
+			if len(index) == 0:
+				continue
+			self.fileNames.append(videoFile['file'])
+			self.indexes.append(index)
+			self.keyFrames.append(numpy.flatnonzero(index['isKeyFrame']))
+			self.startTimes.append(index['sessionTime'][0])
+
+	def findFrame(self, sessionTime):
+		"""
+		Finds the frame that was showing at a session time, i.e. the last frame recorded at or before it.
+
+		:param sessionTime: Seconds since the session started
+		:return: VideoFrame, or None if no frame was recorded by then
+		"""
+		fileNumber = numpy.searchsorted(self.startTimes, sessionTime, side='right') - 1
+		if fileNumber < 0:
+			return None
+		index = self.indexes[fileNumber]
+		i = numpy.searchsorted(index['sessionTime'], sessionTime, side='right') - 1
+		return self.makeFrame(fileNumber, i)
+
+	def findFrames(self, sessionTimes):
+		"""
+		Finds the frames for many session times at once.
+
+		:param sessionTimes: Array of session times
+		:return: List of VideoFrame or None for each session time
+		"""
+		sessionTimes = numpy.asarray(sessionTimes, dtype=float)
+		fileNumbers = numpy.searchsorted(self.startTimes, sessionTimes, side='right') - 1
+		frames = [None] * len(sessionTimes)
+		for fileNumber in range(len(self.indexes)):
+			matches = numpy.flatnonzero(fileNumbers == fileNumber)
+			frameNumbers = numpy.searchsorted(self.indexes[fileNumber]['sessionTime'], sessionTimes[matches], side='right') - 1
+			for match, i in zip(matches, frameNumbers):
+				frames[match] = self.makeFrame(fileNumber, i)
+		return frames
+
+	def makeFrame(self, fileNumber, i):
+		index = self.indexes[fileNumber]
+		keyFrames = self.keyFrames[fileNumber]
+		k = numpy.searchsorted(keyFrames, i, side='right') - 1
+		keyFramePosition = int(index['position'][keyFrames[k]]) if k >= 0 else 0
+		return VideoFrame(self.fileNames[fileNumber], int(index['frame'][i]), float(index['sessionTime'][i]),
+		                  int(index['position'][i]), keyFramePosition)
+
+	def getFrameCount(self):
+		return sum(len(index) for index in self.indexes)
+
+
+
+if __name__ == '__main__':
+	import argparse
+	argParser = argparse.ArgumentParser(description='Find the video frames recorded at session times.')
+	argParser.add_argument('session', help='session directory, e.g. data/001')
+	argParser.add_argument('times', type=float, nargs='+', help='session times in seconds')
+	args = argParser.parse_args()
+
+	videoIndex = VideoIndex(args.session)
+	print(f'{videoIndex.getFrameCount()} frames in {len(videoIndex.fileNames)} video files')
+	for sessionTime, frame in zip(args.times, videoIndex.findFrames(args.times)):
+		print(f'{sessionTime:.3f}: {frame}')